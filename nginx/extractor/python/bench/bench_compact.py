@@ -0,0 +1,91 @@
+"""Rewritten media playlist size and client parse time, proxied URLs vs compact tokens.
+
+Builds VixCloud-style media playlists (absolute segment URLs carrying a
+token query) of several sizes, rewrites each with the normal proxied
+rewriter and with CompactRewriter, and reports bytes on the wire (plain and
+gzipped), the time to scan them line by line, and the time a simple
+player-style parser takes when it also resolves every URI against the
+playlist URL, as a player must.
+
+    python bench/bench_compact.py [--sizes 500 1500 5000] [--repeat 20]
+"""
+import argparse
+import gzip
+import os
+import sys
+import timeit
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+PLAYLIST_URL = "https://vixcloud.co/playlist/290761?type=video&rendition=720p&token=a1b2c3d4e5f6&expires=1792313546"
+SERVED_AT = "http://localhost:5000/api/v1/vixcloud/playlist?url=x&compact=1"
+SEGMENT_URL = ("https://sc-u5-01.scws-content.net/hls/1076/9/7a/97a1b2c3-d4e5-f6a7-b8c9-d0e1f2a3b4c5/720p/"
+               "seg-{n}-v1-a1.ts?token=Zm9vYmFyYmF6cXV4&expires=1792313546&b=1")
+
+
+def media_playlist(segments):
+    lines = [
+        "#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        '#EXT-X-KEY:METHOD=AES-128,URI="https://vixcloud.co/storage/enc.key",IV=0x43A6D967D5C17290D98322F5C8F6660B',
+    ]
+    for n in range(segments):
+        lines.append("#EXTINF:4.000000,")
+        lines.append(SEGMENT_URL.format(n=n))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def parse(playlist, base_url):
+    """What a player does with a media playlist: durations and absolute URIs."""
+    duration = 0.0
+    uris = []
+    for line in playlist.split("\n"):
+        if line.startswith("#EXTINF:"):
+            duration += float(line[8:].split(",", 1)[0])
+        elif line and line[0] != "#":
+            uris.append(urljoin(base_url, line))
+    return duration, uris
+
+
+def scan(playlist):
+    """Line split and classification only: the byte-bound part of parsing."""
+    return sum(1 for line in playlist.split("\n") if line and line[0] != "#")
+
+
+def compact(playlist):
+    return main.CompactRewriter(PLAYLIST_URL).rewrite(playlist)
+
+
+def best(fn, repeat):
+    number = 5
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+
+
+def run(sizes, repeat):
+    print(f"{'segments':>9} {'upstream':>10} {'proxied':>10} {'compact':>10} {'gz proxied':>11} {'gz compact':>11}"
+          f" {'scan proxied':>13} {'scan compact':>13} {'parse proxied':>14} {'parse compact':>14}")
+    for size in sizes:
+        upstream = media_playlist(size)
+        proxied = main.rewrite_manifest(upstream, PLAYLIST_URL)
+        tokens = compact(upstream)
+        assert len(parse(tokens, SERVED_AT)[1]) == len(parse(proxied, SERVED_AT)[1]) == size
+        scan_proxied = best(lambda: scan(proxied), repeat)
+        scan_compact = best(lambda: scan(tokens), repeat)
+        parse_proxied = best(lambda: parse(proxied, SERVED_AT), repeat)
+        parse_compact = best(lambda: parse(tokens, SERVED_AT), repeat)
+        print(f"{size:>9} {len(upstream):>10,} {len(proxied):>10,} {len(tokens):>10,}"
+              f" {len(gzip.compress(proxied.encode())):>11,} {len(gzip.compress(tokens.encode())):>11,}"
+              f" {scan_proxied * 1000:>10.3f} ms {scan_compact * 1000:>10.3f} ms"
+              f" {parse_proxied * 1000:>11.2f} ms {parse_compact * 1000:>11.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 1500, 5000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
@@ -0,0 +1,76 @@
+"""Extraction tail latency with and without hedged upstream requests.
+
+The stand-in origin answers most requests after `--latency` seconds but
+holds `--tail-ratio` of them back for an extra `--tail-latency`. Each run
+does `--requests` full iframe extractions (four upstream calls, caches off),
+first with hedging disabled, then enabled. A last run caps every
+extraction at `--deadline` seconds to show the bound it enforces.
+
+    python bench/bench_hedging.py [--requests 300] [--tail-ratio 0.05] [--tail-latency 1.0]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from fake_origin import FakeOrigin  # noqa: E402
+
+
+async def measure(url, requests, deadline=None):
+    samples = []
+    errors = 0
+    for _ in range(requests):
+        start = time.perf_counter()
+        try:
+            await main.with_deadline(main.extract_vixcloud_manifest(url), deadline)
+        except main.DeadlineExceeded:
+            errors += 1
+        samples.append((time.perf_counter() - start) * 1000)
+    return sorted(samples), errors
+
+
+def report(label, samples, errors):
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+    hedges = main.HEDGED_REQUESTS.values
+    print(f"{label:<22} p50 {at(0.50):7.1f}  p95 {at(0.95):7.1f}  p99 {at(0.99):7.1f}  max {samples[-1]:7.1f} ms"
+          f"   deadline errors {errors:>3}   hedges sent {hedges.get(('sent',), 0):>3} won {hedges.get(('won',), 0):>3}")
+
+
+async def run(args):
+    origin = FakeOrigin(latency=args.latency, tail_ratio=args.tail_ratio, tail_latency=args.tail_latency)
+    base_url = await origin.start()
+    url = f"{base_url}/iframe/1234"
+    # Every extraction makes all four upstream calls
+    main.VERSION_TTL = 0
+    main.manifest_cache.max_size = 0
+    try:
+        main.HEDGING = False
+        await measure(url, 20)
+        report("hedging off", *await measure(url, args.requests))
+
+        main.HEDGING = True
+        await measure(url, 20)
+        main.HEDGED_REQUESTS.values.clear()
+        report("hedging on", *await measure(url, args.requests))
+
+        main.HEDGING = False
+        main.HEDGED_REQUESTS.values.clear()
+        report(f"off, {args.deadline:g}s deadline", *await measure(url, args.requests, args.deadline))
+    finally:
+        await main.get_session().close()
+        await origin.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.01, help="usual origin latency in seconds")
+    parser.add_argument("--tail-ratio", type=float, default=0.05, help="share of origin requests that are slow")
+    parser.add_argument("--tail-latency", type=float, default=1.0, help="extra delay of a slow request in seconds")
+    parser.add_argument("--deadline", type=float, default=0.5, help="end-to-end budget for the last run")
+    asyncio.run(run(parser.parse_args()))
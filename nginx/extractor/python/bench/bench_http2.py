@@ -0,0 +1,112 @@
+"""Upstream fan-out over the aiohttp HTTP/1.1 pool vs the opt-in HTTP/2 transport.
+
+Runs the stand-in origin in its own process, over HTTPS through hypercorn
+(self-signed certificate made with the openssl CLI and trusted through
+SSL_CERT_FILE).
+Each viewer does what one playback start costs upstream: a full extraction
+(caches off), the master playlist, then its three video playlists in
+parallel. `--viewers` start at once, for each concurrency level, first with
+EXTRACTOR_HTTP2 off, then on. The report has wall time, per-viewer
+p50/p95 and how many TCP connections the origin accepted. A last run
+points the HTTP/2 transport at an origin that only offers HTTP/1.1, to
+show the fallback.
+
+    python bench/bench_http2.py [--viewers 10 50 200] [--latency 0.1]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+CERT_DIR = tempfile.mkdtemp(prefix="bench-http2-")
+CERTFILE = os.path.join(CERT_DIR, "cert.pem")
+KEYFILE = os.path.join(CERT_DIR, "key.pem")
+# Both must exist before aiohttp builds its default SSL context at import
+subprocess.run(
+    ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+     "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", KEYFILE, "-out", CERTFILE],
+    check=True, capture_output=True,
+)
+os.environ["SSL_CERT_FILE"] = CERTFILE
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import aiohttp  # noqa: E402
+import main  # noqa: E402
+from loadtest import HERE, spawn, upstream_hits, wait_until_up  # noqa: E402
+
+
+async def viewer(base_url, title):
+    start = time.perf_counter()
+    page = f"{base_url}/iframe/{title}"
+    manifest_url = await main.with_deadline(main.extract_vixcloud_manifest(page))
+    status, master = await main.fetch(manifest_url, {"Referer": page})
+    assert status == 200, status
+    variants = [line for line in master.split("\n") if line.startswith("https://")]
+    for status, _ in await asyncio.gather(*(main.fetch(variant, {"Referer": page}) for variant in variants)):
+        assert status == 200, status
+    return (time.perf_counter() - start) * 1000
+
+
+async def measure(session, origin_url, viewers, http2):
+    """Run `viewers` at once on fresh pools; wall time, sorted latencies and origin counter deltas."""
+    main.HTTP2 = http2
+    await main.close_upstream()
+    main.http2_upstream.http1_hosts.clear()
+    before = await upstream_hits(session, origin_url)
+    start = time.perf_counter()
+    samples = sorted(await asyncio.gather(*(viewer(origin_url, n) for n in range(viewers))))
+    elapsed = time.perf_counter() - start
+    after = await upstream_hits(session, origin_url)
+    return elapsed, samples, after["total"] - before["total"], after["connections"] - before["connections"]
+
+
+def report(label, viewers, elapsed, samples, requests, connections):
+    def at(fraction):
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+    print(f"{label:<26} {viewers:>7} {elapsed * 1000:>9.0f} ms {at(0.5):>8.0f} ms {at(0.95):>8.0f} ms"
+          f" {requests:>9} {connections:>12}")
+
+
+def start_origin(port, latency, alpn):
+    return spawn(["fake_origin.py", "--port", str(port), "--latency", str(latency), "--alpn", alpn,
+                  "--certfile", CERTFILE, "--keyfile", KEYFILE], HERE)
+
+
+async def run(args):
+    # Every viewer makes all its upstream calls
+    main.VERSION_TTL = 0
+    main.manifest_cache.max_size = 0
+    main.HEDGING = False
+    h2_url, h1_url = f"https://127.0.0.1:{args.port}", f"https://127.0.0.1:{args.port + 1}"
+    origins = [start_origin(args.port, args.latency, "h2,http/1.1"),
+               start_origin(args.port + 1, args.latency, "http/1.1")]
+    print(f"{'transport':<26} {'viewers':>7} {'wall':>12} {'p50':>11} {'p95':>11} {'requests':>9} {'connections':>12}")
+    try:
+        async with aiohttp.ClientSession() as session:
+            for url in (h2_url, h1_url):
+                await wait_until_up(session, f"{url}/__hits")
+            for viewers in args.viewers:
+                await measure(session, h2_url, 5, False)
+                report("http/1.1 (aiohttp)", viewers, *await measure(session, h2_url, viewers, False))
+                await measure(session, h2_url, 5, True)
+                report("http/2 (httpx)", viewers, *await measure(session, h2_url, viewers, True))
+            report("http/2 on, h1-only origin", args.viewers[0], *await measure(session, h1_url, args.viewers[0], True))
+        print(f"http1 hosts: {main.http2_upstream.stats()['http1_hosts']}, requests handed to HTTP/1.1: {dict(main.HTTP2_FALLBACKS.values)}")
+        assert main.http2_upstream.stats()["http1_hosts"] == [h1_url.split("://")[1]]
+    finally:
+        await main.close_upstream()
+        for origin in origins:
+            origin.terminate()
+            origin.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--viewers", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--latency", type=float, default=0.1, help="origin latency in seconds")
+    parser.add_argument("--port", type=int, default=8443, help="HTTPS origin port; the HTTP/1.1-only one takes the next")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,134 @@
+"""Parity check and microbenchmark for the manifest rewrite engine.
+
+First checks that ManifestRewriter produces byte-for-byte the output of the
+original per-line rewrite_manifest (kept below as `reference_rewrite`) on
+a set of awkward URIs and on generated playlists. Then times both across
+playlist sizes.
+
+    python bench/bench_rewrite.py [--sizes 100 1000 3000 10000] [--repeat 20]
+"""
+import argparse
+import os
+import re
+import sys
+import timeit
+from urllib.parse import urljoin, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+
+BASE_URLS = [
+    "https://vixcloud.co/playlist/1234?type=video&rendition=720p&token=abc&expires=1",
+    "https://sc-u1-01.scws-content.net/hls/100/a/b/./c/playlist.m3u8?x=1",
+    "https://cdn.example.com",
+    "http://cdn.example.com/a//b/index.m3u8",
+]
+
+AWKWARD_LINES = [
+    "seg-1-v1-a1.ts",
+    "seg-1-v1-a1.ts?token=abc&expires=1",
+    "  seg-2.ts  \r",
+    "/hls/100/seg-3.ts",
+    "//other.host/seg-4.ts",
+    "https://other.host/seg-5.ts",
+    "http_seg.ts",
+    "../up/seg-6.ts",
+    "./seg-7.ts",
+    "sub/./seg-8.ts",
+    "sub//seg-9.ts",
+    "?only=query",
+    "#fragment-only",
+    "seg-10.ts?",
+    "seg-11.ts#frag",
+    "seg;params.ts",
+    "data:seg.ts",
+    ".hidden.ts",
+    "",
+    "#EXTM3U",
+    "#EXTINF:4.000000,",
+    '#EXT-X-KEY:METHOD=AES-128,URI="/storage/enc.key",IV=0x43A6D967',
+    "#EXT-X-KEY:METHOD=AES-128,URI='key.bin'",
+    "#EXT-X-KEY:METHOD=AES-128,URI=key.bin,IV=0x1",
+    "#EXT-X-KEY:METHOD=NONE",
+    '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",NAME="Italian",URI="audio/ita.m3u8?x=1"',
+    '#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="s",NAME="English",URI="https://subs.host/eng.m3u8"',
+    '#EXT-X-MEDIA:TYPE=CLOSED-CAPTIONS,GROUP-ID="cc",INSTREAM-ID="CC1"',
+    '#EXT-X-STREAM-INF:BANDWIDTH=1200000,RESOLUTION=854x480,AUDIO="a"',
+]
+
+
+def reference_resolve_url(url, base_url):
+    """resolve_url as it was before the rewrite engine."""
+    if url.startswith('http'):
+        return url
+    elif url.startswith('/'):
+        parsed = urlparse(base_url)
+        return f"{parsed.scheme}://{parsed.netloc}{url}"
+    else:
+        return urljoin(base_url, url)
+
+
+def reference_rewrite(manifest_content, base_url):
+    """rewrite_manifest as it was before the rewrite engine."""
+    lines = manifest_content.split('\n')
+    modified_lines = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith('#EXT-X-KEY:') or line.startswith('#EXT-X-MEDIA'):
+            uri_match = re.search(r'URI=(["\']?)([^",\s]+)\1', line)
+            if uri_match:
+                full_uri = reference_resolve_url(uri_match.group(2), base_url)
+                line = line.replace(uri_match.group(0), f'URI="{main.NGINX_PROXY_BASE}{full_uri}"')
+            modified_lines.append(line)
+        elif line and not line.startswith('#'):
+            modified_lines.append(f"{main.NGINX_PROXY_BASE}{reference_resolve_url(line, base_url)}")
+        else:
+            modified_lines.append(line)
+    return '\n'.join(modified_lines)
+
+
+def media_playlist(segments):
+    lines = [
+        "#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:4", "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        '#EXT-X-KEY:METHOD=AES-128,URI="/storage/enc.key",IV=0x43A6D967D5C17290D98322F5C8F6660B',
+    ]
+    for n in range(segments):
+        lines.append("#EXTINF:4.000000,")
+        lines.append(f"seg-{n}-v1-a1.ts" if n % 2 else f"/hls/100/seg-{n}-v1-a1.ts?rendition=720p")
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def check_parity():
+    cases = ["\n".join(AWKWARD_LINES), "\r\n".join(AWKWARD_LINES) + "\n", media_playlist(500)]
+    cases += AWKWARD_LINES
+    checked = 0
+    for base_url in BASE_URLS:
+        for content in cases:
+            expected = reference_rewrite(content, base_url)
+            actual = main.rewrite_manifest(content, base_url)
+            assert actual == expected, (base_url, content, expected, actual)
+            checked += 1
+    print(f"parity: {checked} manifests byte-for-byte identical")
+
+
+def bench(sizes, repeat):
+    base_url = BASE_URLS[0]
+    print(f"{'segments':>9} {'reference':>12} {'engine':>12} {'speed-up':>9}")
+    for size in sizes:
+        content = media_playlist(size)
+        number = max(1, 20000 // size)
+        before = min(timeit.repeat(lambda: reference_rewrite(content, base_url), number=number, repeat=repeat)) / number
+        after = min(timeit.repeat(lambda: main.rewrite_manifest(content, base_url), number=number, repeat=repeat)) / number
+        print(f"{size:>9} {before * 1000:>9.3f} ms {after * 1000:>9.3f} ms {before / after:>8.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 3000, 10000])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    check_parity()
+    bench(args.sizes, args.repeat)
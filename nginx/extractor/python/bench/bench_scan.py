@@ -0,0 +1,77 @@
+"""CPU cost of the VixCloud page scrape: BeautifulSoup vs the targeted scanner.
+
+Uses the saved pages in bench/fixtures (request-a-title, iframe, embed), checks
+that both paths extract identical fields, then times one full iframe
+extraction's worth of parsing with each.
+
+    python bench/bench_scan.py [--number 200]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+import main  # noqa: E402
+
+
+def load(name):
+    with open(os.path.join(HERE, "fixtures", name), encoding="utf-8") as fixture:
+        return fixture.read()
+
+
+def soup_extract(version_page, iframe_page, embed_page):
+    """The scrape as it was done with BeautifulSoup for every field."""
+    soup = BeautifulSoup(version_page, "lxml", parse_only=SoupStrainer("div", {"id": "app"}))
+    version = json.loads(soup.find("div", {"id": "app"}).get("data-page"))["version"]
+    soup = BeautifulSoup(iframe_page, "lxml", parse_only=SoupStrainer("iframe"))
+    iframe = soup.find("iframe").get("src")
+    soup = BeautifulSoup(embed_page, "lxml", parse_only=SoupStrainer("body"))
+    script = soup.find("body").find("script").text
+    token = re.search(r"'token':\s*'(\w+)'", script).group(1)
+    expires = re.search(r"'expires':\s*'(\d+)'", script).group(1)
+    server_url = re.search(r"url:\s*'([^']+)'", script).group(1)
+    return version, iframe, token, expires, server_url
+
+
+def scan_extract(version_page, iframe_page, embed_page):
+    """The same fields through main's scanner layer."""
+    version = main.find_inertia_version(version_page)
+    iframe = main.find_iframe_src(iframe_page)
+    script = main.find_body_script(embed_page)
+    token = main.TOKEN_RE.search(script).group(1)
+    expires = main.EXPIRES_RE.search(script).group(1)
+    server_url = main.SERVER_URL_RE.search(script).group(1)
+    return version, iframe, token, expires, server_url
+
+
+def cpu_per_call(fn, pages, number):
+    start = time.process_time()
+    for _ in range(number):
+        fn(*pages)
+    return (time.process_time() - start) / number
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=200)
+    args = parser.parse_args()
+
+    pages = [load(name) for name in ("request-a-title.html", "iframe.html", "embed.html")]
+    expected = soup_extract(*pages)
+    assert scan_extract(*pages) == expected, (scan_extract(*pages), expected)
+    assert not any(main.scan_fallbacks.values()), main.scan_fallbacks
+    print(f"fields match: version={expected[0]} expires={expected[3]}")
+
+    before = cpu_per_call(soup_extract, pages, args.number)
+    after = cpu_per_call(scan_extract, pages, args.number * 10)
+    print(f"fixture pages: {sum(len(page) for page in pages) / 1024:.1f} KiB")
+    print(f"beautifulsoup  {before * 1e6:9.1f} us CPU per extraction")
+    print(f"scanner        {after * 1e6:9.1f} us CPU per extraction")
+    print(f"saved          {(before - after) * 1e6:9.1f} us CPU per extraction ({before / after:.0f}x)")
@@ -0,0 +1,86 @@
+"""Per-request latency of one manifest extraction, fresh session vs shared pool.
+
+Runs the full iframe flow (version, iframe, embed, manifest: four upstream
+calls) against the local stand-in origin, first with the old behaviour of a
+new aiohttp.ClientSession per call, then with the pooled session from main.
+
+    python bench/bench_session.py [--requests 300] [--latency 0.0]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from fake_origin import FakeOrigin  # noqa: E402
+
+
+async def fresh_session_fetch(url, headers=None):
+    """The pre-pool request: one ClientSession (and connection) per call."""
+    if headers is None:
+        headers = {}
+    if 'User-Agent' not in headers:
+        headers['User-Agent'] = main.USER_AGENT
+    async with aiohttp.ClientSession() as session:
+        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
+            return response.status, await response.text()
+
+
+async def one_playback(url):
+    manifest_url = await main.extract_vixcloud_manifest(url)
+    await main.make_request(manifest_url, {"referer": url})
+
+
+async def measure(url, requests):
+    samples = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        await one_playback(url)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<16} mean {statistics.mean(samples):7.2f} ms   p50 {statistics.median(samples):7.2f} ms   p95 {p95:7.2f} ms")
+
+
+async def run(args):
+    origin = FakeOrigin(latency=args.latency)
+    base_url = await origin.start()
+    url = f"{base_url}/iframe/1234"
+    # Keep all four upstream calls in play: this measures pooling only.
+    main.VERSION_TTL = 0
+    main.manifest_cache.max_size = 0
+    pooled_fetch = main.fetch
+    try:
+        main.fetch = fresh_session_fetch
+        await measure(url, 5)
+        before = await measure(url, args.requests)
+
+        main.fetch = pooled_fetch
+        await measure(url, 5)
+        after = await measure(url, args.requests)
+    finally:
+        main.fetch = pooled_fetch
+        await main.get_session().close()
+        await origin.stop()
+
+    print(f"{args.requests} extractions of {url} (4 upstream calls each)")
+    report("fresh session", before)
+    report("shared pool", after)
+    print(f"speed-up (mean)  {statistics.mean(before) / statistics.mean(after):.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--latency", type=float, default=0.0, help="artificial origin latency in seconds")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,99 @@
+"""Extractor cold start: import time and time to the first served manifest.
+
+Import time is measured in fresh interpreters, for the ASGI entry point
+(`import main`) and for the Flask one (`main.app`), with the modules each
+leaves loaded. Then each server mode is spawned `--runs` times against the
+stand-in origin, with and without EXTRACTOR_PREWARM_SITES pointing at it,
+and the script reports how long after spawn the server first answered, the
+latency of the first /manifest request and the total from spawn to that
+first manifest.
+
+    python bench/bench_startup.py [--runs 5] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+from fake_origin import FakeOrigin
+from loadtest import EXTRACTOR_DIR, SERVERS, spawn, wait_until_up
+
+IMPORTS = {
+    "asgi (import main)": "import main",
+    "flask (main.app)": "import main; main.app",
+}
+
+MEASURE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+exec(sys.argv[1])
+print(json.dumps([time.perf_counter() - start, [name for name in ("flask", "flask_cors", "bs4") if name in sys.modules]]))
+"""
+
+
+def import_time(statement, runs):
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", MEASURE_IMPORT, statement], cwd=EXTRACTOR_DIR,
+                                capture_output=True, text=True, check=True).stdout
+        seconds, loaded = json.loads(output)
+        samples.append(seconds * 1000)
+    return statistics.median(samples), loaded
+
+
+async def first_manifest(mode, port, env, manifest_url):
+    """Spawn one server; return ms to first answer, first manifest latency and total."""
+    start = time.perf_counter()
+    server = spawn(["-c", SERVERS[mode].format(port=port)], EXTRACTOR_DIR, env)
+    try:
+        async with aiohttp.ClientSession() as session:
+            await wait_until_up(session, f"http://127.0.0.1:{port}/api/v1/vixcloud/stats")
+            up = time.perf_counter()
+            async with session.get(f"http://127.0.0.1:{port}/api/v1/vixcloud/manifest",
+                                   params={"url": manifest_url}) as response:
+                await response.read()
+                assert response.status == 200, response.status
+            done = time.perf_counter()
+    finally:
+        server.terminate()
+        server.wait()
+    return (up - start) * 1000, (done - up) * 1000, (done - start) * 1000
+
+
+async def run(args):
+    print(f"{'import':<22} {'median':>10}  extra modules loaded")
+    for label, statement in IMPORTS.items():
+        median, loaded = await asyncio.to_thread(import_time, statement, args.runs)
+        print(f"{label:<22} {median:>7.1f} ms  {', '.join(loaded) or '-'}")
+
+    origin = FakeOrigin(latency=args.latency)
+    base_url = await origin.start()
+    manifest_url = f"{base_url}/iframe/1234"
+    print(f"\n{'server':<18} {'up':>10} {'first manifest':>15} {'total':>10}   (median of {args.runs})")
+    try:
+        port = args.port
+        for mode in ("asgi", "flask"):
+            for prewarm in (False, True):
+                env = {"EXTRACTOR_PREWARM_SITES": base_url if prewarm else ""}
+                samples = []
+                for _ in range(args.runs):
+                    samples.append(await first_manifest(mode, port, env, manifest_url))
+                    port += 1
+                up, first, total = (statistics.median(column) for column in zip(*samples))
+                label = f"{mode}, prewarm {'on' if prewarm else 'off'}"
+                print(f"{label:<18} {up:>7.1f} ms {first:>12.1f} ms {total:>7.1f} ms")
+    finally:
+        await origin.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="origin latency in seconds")
+    parser.add_argument("--port", type=int, default=5300, help="first extractor port; each run takes the next one")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,106 @@
+"""Time to first byte and peak memory of buffered vs streamed manifest rewriting.
+
+Fetches a long VOD media playlist from the stand-in origin, which sends it in
+chunks `--chunk-delay` seconds apart, and rewrites it either after buffering
+the whole body (make_request + rewrite_manifest) or line by line through
+ManifestStream + rewrite_manifest_stream, with one reader and with
+`--readers` readers sharing the download. A streamed line is dropped once
+every reader has had it, so peak allocation should not grow with
+`--segments`.
+
+    python bench/bench_streaming.py [--segments 3000] [--chunk-delay 0.02] [--runs 20] [--readers 4]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from fake_origin import FakeOrigin  # noqa: E402
+
+
+async def buffered(url):
+    start = time.perf_counter()
+    content = await main.make_request(url)
+    body = main.rewrite_manifest(content, url)
+    first = time.perf_counter() - start
+    return first, time.perf_counter() - start, len(body)
+
+
+async def streamed(url):
+    start = time.perf_counter()
+    stream = main.ManifestStream()
+    await stream.open(url)
+    first = None
+    size = 0
+    async for chunk in main.rewrite_manifest_stream(stream, url):
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    return first, time.perf_counter() - start, size
+
+
+async def shared(url, readers):
+    start = time.perf_counter()
+    stream = main.ManifestStream()
+    await stream.open(url)
+    firsts = []
+
+    async def read(reader):
+        size = 0
+        async for chunk in main.rewrite_manifest_stream(reader, url):
+            if not size:
+                firsts.append(time.perf_counter() - start)
+            size += len(chunk)
+        return size
+
+    sizes = await asyncio.gather(*(read(stream.join()) for _ in range(readers)))
+    assert len(set(sizes)) == 1, sizes
+    return max(firsts), time.perf_counter() - start, sizes[0]
+
+
+async def measure(fn, url, runs):
+    results = [await fn(url) for _ in range(runs)]
+    tracemalloc.start()
+    await fn(url)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return results, peak
+
+
+def report(label, results, peak):
+    ttfb = statistics.median(r[0] for r in results) * 1000
+    total = statistics.median(r[1] for r in results) * 1000
+    print(f"{label:<9} ttfb {ttfb:8.2f} ms   total {total:8.2f} ms   peak alloc {peak / 1024:8.1f} KiB   body {results[0][2]} chars")
+
+
+async def run(args):
+    origin = FakeOrigin(chunk_delay=args.chunk_delay, segments=args.segments)
+    base_url = await origin.start()
+    url = f"{base_url}/playlist/1234?type=video&rendition=720p&token=abc&expires=0"
+    try:
+        before = await measure(buffered, url, args.runs)
+        after = await measure(streamed, url, args.runs)
+        together = await measure(lambda url: shared(url, args.readers), url, args.runs)
+    finally:
+        await main.get_session().close()
+        await origin.stop()
+
+    print(f"{args.segments}-segment media playlist, {args.chunk_delay * 1000:.0f} ms between upstream chunks")
+    report("buffered", *before)
+    report("streamed", *after)
+    report(f"shared x{args.readers}", *together)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--segments", type=int, default=3000)
+    parser.add_argument("--chunk-delay", type=float, default=0.02)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--readers", type=int, default=4, help="readers sharing one download")
+    asyncio.run(run(parser.parse_args()))
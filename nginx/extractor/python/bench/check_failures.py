@@ -0,0 +1,108 @@
+"""Check negative caching of failed extractions and the per-host circuit breaker.
+
+Against the stand-in origin:
+  * a title whose page is gone is scraped once, then answered from the
+    negative cache until NEGATIVE_TTL passes;
+  * a player script without a token fails with ExtractionError (502),
+    not AttributeError;
+  * a URL that is not an iframe, movie or tv URL is a 400, answered
+    without an upstream call and kept out of the negative cache;
+  * a cached manifest URL whose playlist the origin starts refusing is a
+    502, not an error body streamed as a playlist, and the next request
+    scrapes a fresh one;
+  * while the origin answers 503, the breaker opens after BREAKER_FAILURES
+    calls and then refuses the host without touching it, lets one trial
+    through after the cooldown, and closes once the origin recovers.
+
+    python bench/check_failures.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from fake_origin import FakeOrigin  # noqa: E402
+
+
+async def expect_error(url, error_type):
+    return await expect_error_from(main.extract_vixcloud_manifest(url), error_type)
+
+
+async def expect_error_from(coro, error_type):
+    try:
+        await main.with_deadline(coro)
+    except error_type as e:
+        return e
+    raise AssertionError(f"{coro.__qualname__} did not raise {error_type.__name__}")
+
+
+async def run():
+    origin = FakeOrigin()
+    base_url = await origin.start()
+    host = base_url.split("://")[1]
+    main.upstream_breaker.cooldown = 0.5
+    try:
+        missing = f"{base_url}/tv/1"
+        for _ in range(5):
+            error = await expect_error(missing, main.ExtractionError)
+        print(f"missing page: {error} -> HTTP {main.error_status(error)}, upstream {dict(origin.hits)}")
+        assert origin.hits == {"/tv/1": 1}
+
+        script = "window.masterPlaylist = { params: { 'expires': '1' }, url: 'https://x/playlist/1' }"
+        try:
+            main.script_param(main.TOKEN_RE, script, "token")
+        except main.ExtractionError as e:
+            print(f"changed script: {e} -> HTTP {main.error_status(e)}")
+        else:
+            raise AssertionError("missing token was not reported")
+
+        origin.hits.clear()
+        wrong = f"{base_url}/about"
+        error = await expect_error(wrong, main.InvalidUrl)
+        print(f"wrong url: {error} -> HTTP {main.error_status(error)}")
+        assert main.error_status(error) == 400
+        assert not origin.hits and await main.failure_cache.aget(wrong) is None
+
+        title = f"{base_url}/movie/50"
+        manifest_url, reader = await main.with_deadline(main.open_manifest(title))
+        assert [line async for batch in reader.batches() for line in batch][0] == "#EXTM3U"
+        origin.revoked.add("50")
+        error = await expect_error_from(main.open_manifest(title), main.ExtractionError)
+        print(f"revoked token: {error} -> HTTP {main.error_status(error)}")
+        assert main.error_status(error) == 502 and await main.manifest_cache.aget(title) is None
+        origin.revoked.clear()
+        origin.hits.clear()
+        await main.with_deadline(main.open_manifest(title))
+        assert origin.hits["/movie/50"] == 1, dict(origin.hits)
+        print("after the refusal: scraped again")
+
+        origin.failing = True
+        origin.hits.clear()
+        for n in range(10):
+            await expect_error(f"{base_url}/movie/{n}", Exception)
+        print(f"outage: 10 extractions, {sum(origin.hits.values())} upstream calls, breakers {main.upstream_breaker.stats()}")
+        assert sum(origin.hits.values()) == main.BREAKER_FAILURES
+        error = await expect_error(f"{base_url}/movie/99", main.HostUnavailable)
+        print(f"fail fast: {error} -> HTTP {main.error_status(error)}")
+
+        await asyncio.sleep(0.6)
+        await expect_error(f"{base_url}/movie/100", main.ExtractionError)
+        assert sum(origin.hits.values()) == main.BREAKER_FAILURES + 1
+        await expect_error(f"{base_url}/movie/101", main.HostUnavailable)
+        print("half-open: one failed trial reopened the breaker")
+
+        origin.failing = False
+        await asyncio.sleep(0.6)
+        await main.with_deadline(main.extract_vixcloud_manifest(f"{base_url}/movie/102"))
+        assert host not in main.upstream_breaker.stats()
+        print("recovered: trial succeeded, breaker closed")
+    finally:
+        await main.get_session().close()
+        await origin.stop()
+    print("ok")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
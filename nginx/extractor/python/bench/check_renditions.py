@@ -0,0 +1,86 @@
+"""Check the master playlist rendition filter against both tag orders HLS allows.
+
+Takes the stand-in origin's master as is (renditions before variants) and
+with its #EXT-X-MEDIA lines moved after the variants, and runs each
+RenditionFilter option over both, fed whole and one line per batch the way
+the streamed rewrite does. For every run it asserts that:
+  * each SUBTITLES/AUDIO group a kept variant points at has a kept
+    rendition, and no kept subtitle rendition is left without a variant;
+  * `subs=eng` keeps SUBTITLES="subs" on the variants in either order;
+  * the kept variants and their order do not depend on the tag order.
+
+    python bench/check_renditions.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from fake_origin import FakeOrigin  # noqa: E402
+
+OPTIONS = [
+    {"subs": "eng"},
+    {"subs": "none"},
+    {"subs": "ita"},
+    {"audio": "eng"},
+    {"max_height": "720", "subs": "eng"},
+    {"max_height": "100", "subs": "none"},
+]
+
+
+def masters():
+    origin = FakeOrigin()
+    origin.base_url = "https://origin.test"
+    lines = origin.master_page("1", "token=t&expires=1").splitlines()
+    media = [line for line in lines if line.startswith("#EXT-X-MEDIA:")]
+    rest = [line for line in lines if not line.startswith("#EXT-X-MEDIA:")]
+    return {"renditions first": lines, "variants first": rest + media}
+
+
+def run_filter(options, lines, batch):
+    renditions = main.RenditionFilter.from_query(options)
+    kept = []
+    for start in range(0, len(lines), batch):
+        kept += renditions.filter_lines(lines[start:start + batch])
+    return kept + renditions.finish()
+
+
+def check(kept):
+    """Kept variant tags in order, after asserting every group reference resolves."""
+    groups = {}
+    for line in kept:
+        if line.startswith("#EXT-X-MEDIA:"):
+            attributes = main.tag_attributes(line)
+            groups.setdefault(attributes["TYPE"], set()).add(attributes["GROUP-ID"])
+    variants = [line for line in kept if line.startswith("#EXT-X-STREAM-INF")]
+    referenced = set()
+    for variant in variants:
+        attributes = main.tag_attributes(variant)
+        for kind in ("AUDIO", "SUBTITLES"):
+            if kind in attributes:
+                assert attributes[kind] in groups.get(kind, ()), f"{variant} points at a dropped {kind} group"
+                referenced.add(attributes[kind])
+    orphans = groups.get("SUBTITLES", set()) - referenced
+    assert not orphans, f"subtitle groups without a variant: {orphans}"
+    return variants
+
+
+def run():
+    for options in OPTIONS:
+        results = {}
+        for order, lines in masters().items():
+            for batch in (len(lines), 1):
+                results[(order, batch)] = check(run_filter(options, lines, batch))
+        variants = results[("renditions first", len(masters()["renditions first"]))]
+        assert all(other == variants for other in results.values()), f"{options}: output depends on tag order"
+        if options.get("subs") == "eng":
+            assert all('SUBTITLES="subs"' in variant for variant in variants), f"{options}: subtitles stripped"
+        query = "&".join(f"{name}={value}" for name, value in options.items())
+        subtitles = sum('SUBTITLES=' in variant for variant in variants)
+        print(f"{query:<24} {len(variants)} variants, {subtitles} with SUBTITLES, same in both orders")
+    print("ok")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,61 @@
+"""Check that worker processes share extractor cache hits through SQLite.
+
+Runs `--workers` separate Python processes one after another, as gunicorn
+workers would be, each resolving the manifest URL of the same `--titles`
+titles against the stand-in origin. With the memory backend every worker
+scrapes every title again; with the SQLite backend only the first does.
+
+    python bench/check_shared_cache.py [--workers 4] [--titles 20]
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+from fake_origin import FakeOrigin
+
+EXTRACTOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+WORKER = """
+import asyncio, sys, main
+async def run(urls):
+    for url in urls:
+        await main.extract_vixcloud_manifest(url)
+    await main.get_session().close()
+asyncio.run(run(sys.argv[1:]))
+"""
+
+
+def run_workers(backend, path, urls, workers):
+    env = {**os.environ, "EXTRACTOR_CACHE_BACKEND": backend, "EXTRACTOR_CACHE_PATH": path}
+    for _ in range(workers):
+        subprocess.run([sys.executable, "-c", WORKER, *urls], cwd=EXTRACTOR_DIR, env=env, check=True)
+
+
+async def run(args):
+    origin = FakeOrigin()
+    base_url = await origin.start()
+    urls = [f"{base_url}/iframe/{n}" for n in range(1, args.titles + 1)]
+    try:
+        for backend in ("memory", "sqlite"):
+            with tempfile.TemporaryDirectory() as directory:
+                origin.hits.clear()
+                path = os.path.join(directory, "cache.sqlite3")
+                await asyncio.to_thread(run_workers, backend, path, urls, args.workers)
+                scrapes = sum(count for page, count in origin.hits.items() if page.startswith("/iframe/"))
+                print(f"{backend:<7} {args.workers} workers x {args.titles} titles: "
+                      f"{scrapes} iframe scrapes, {origin.hits['/request-a-title']} version fetches")
+                expected = args.titles * (args.workers if backend == "memory" else 1)
+                assert scrapes == expected, (backend, scrapes, expected)
+    finally:
+        await origin.stop()
+    print("ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--titles", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,41 @@
+"""Check that concurrent manifest requests for one title share the upstream work.
+
+Fires `--clients` simultaneous fetch_manifest calls for the same iframe URL at
+the stand-in origin and asserts that each upstream page was requested once,
+while every caller still got its own complete, rewritten manifest.
+
+    python bench/check_singleflight.py [--clients 50]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import main  # noqa: E402
+from fake_origin import FakeOrigin  # noqa: E402
+
+
+async def run(args):
+    origin = FakeOrigin(latency=0.05)
+    base_url = await origin.start()
+    url = f"{base_url}/iframe/1234"
+    try:
+        manifests = await asyncio.gather(*(main.fetch_manifest(url) for _ in range(args.clients)))
+    finally:
+        await main.get_session().close()
+        await origin.stop()
+
+    print(f"{args.clients} concurrent clients, upstream requests: {dict(origin.hits)}")
+    assert origin.hits == {"/request-a-title": 1, "/iframe/1234": 1, "/embed/1234": 1, "/playlist/1234": 1}
+    assert len({id(manifest) for manifest in manifests}) == args.clients
+    assert all(manifest == manifests[0] and manifest.startswith("#EXTM3U") for manifest in manifests)
+    assert main.manifest_flight.coalesced == args.clients - 1
+    print("ok")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=50)
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,285 @@
+"""Local stand-in for the VixCloud origin, used by the benchmarks in this folder.
+
+Serves just enough of the real site for extract_vixcloud_manifest to run
+end to end: the inertia `request-a-title` page, iframe and embed pages and
+master and media playlists. Every request is counted per path in
+`origin.hits` (also served as JSON at `/__hits`). Media playlists are sent in chunks, `chunk_delay` seconds
+apart, so streaming consumers can be told apart from buffering ones.
+Inertia requests carrying a version other than `origin.version` get the
+409 Conflict the real site sends for stale assets. With `tail_ratio` set,
+that share of requests is held back an extra `tail_latency` seconds, to
+give the latency distribution a slow tail. Setting `origin.failing`
+makes every page answer 503, as during an outage; playlists of the video
+ids in `origin.revoked` answer 403, as for a token the site has revoked.
+
+`start_tls` serves the same pages over HTTPS through hypercorn, offering h2
+and/or HTTP/1.1 by ALPN; `origin.connections` counts the client
+connections either server accepted.
+
+Run standalone with `python fake_origin.py [--port 8081] [--latency 0.05]`,
+adding `--certfile cert.pem --keyfile key.pem [--alpn http/1.1]` for HTTPS.
+"""
+import argparse
+import asyncio
+import html
+import json
+import random
+import re
+import socket
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from aiohttp import web
+
+VERSION = "f3b1c2d4e5"
+ASGI_PATH_RE = re.compile(r"^/(?P<kind>iframe|embed|movie|tv|playlist)/(?P<id>[^/]+)")
+
+
+class FakeOrigin:
+    """aiohttp app serving the fake VixCloud pages."""
+
+    def __init__(self, latency=0.0, chunk_delay=0.0, segments=1500, tail_ratio=0.0, tail_latency=0.0, seed=1):
+        self.latency = latency
+        self.tail_ratio = tail_ratio
+        self.tail_latency = tail_latency
+        self.random = random.Random(seed)
+        self.chunk_delay = chunk_delay
+        self.segments = segments
+        self.version = VERSION
+        self.failing = False
+        self.revoked = set()
+        self.hits = Counter()
+        self.connections = set()
+        self.base_url = None
+        self._runner = None
+        self._server = None
+        self._shutdown = None
+
+    def build_app(self):
+        app = web.Application(middlewares=[self._count])
+        app.router.add_get("/request-a-title", self.request_a_title)
+        app.router.add_get("/iframe/{id}", self.iframe)
+        app.router.add_get("/embed/{id}", self.embed)
+        app.router.add_get("/movie/{id}", self.embed)
+        app.router.add_get("/tv/{id}/{season}/{episode}", self.embed)
+        app.router.add_get("/playlist/{id}", self.playlist)
+        app.router.add_get("/__hits", self.report_hits)
+        return app
+
+    @web.middleware
+    async def _count(self, request, handler):
+        if request.path == "/__hits":
+            return await handler(request)
+        self.connections.add(request.transport.get_extra_info("peername"))
+        refusal = await self._admit(request.path, request.headers, str(request.url))
+        if refusal is not None:
+            status, headers = refusal
+            return web.Response(status=status, headers=headers)
+        return await handler(request)
+
+    async def _admit(self, path, headers, url):
+        """Count and delay a request; (status, headers) if it is refused."""
+        self.hits[path] += 1
+        delay = self.latency
+        if self.tail_ratio and self.random.random() < self.tail_ratio:
+            delay += self.tail_latency
+        if delay:
+            await asyncio.sleep(delay)
+        if self.failing:
+            return 503, {}
+        if path.startswith("/playlist/") and path.split("/")[2] in self.revoked:
+            return 403, {}
+        if "x-inertia" in headers and headers.get("x-inertia-version") != self.version:
+            return 409, {"X-Inertia-Location": url}
+        return None
+
+    async def start(self, host="127.0.0.1", port=0):
+        self._runner = web.AppRunner(self.build_app(), access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://{host}:{port}"
+        return self.base_url
+
+    async def start_tls(self, certfile, keyfile, alpn=("h2", "http/1.1"), host="127.0.0.1", port=0):
+        """Serve the pages over HTTPS with hypercorn, offering the `alpn` protocols."""
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+
+        if not port:
+            with socket.socket() as probe:
+                probe.bind((host, 0))
+                port = probe.getsockname()[1]
+        config = Config()
+        config.bind = [f"{host}:{port}"]
+        config.certfile = certfile
+        config.keyfile = keyfile
+        config.alpn_protocols = list(alpn)
+        config.accesslog = config.errorlog = None
+        self._shutdown = asyncio.Event()
+        self._server = asyncio.ensure_future(serve(self.asgi_app, config, shutdown_trigger=self._shutdown.wait))
+        self.base_url = f"https://{host}:{port}"
+        for _ in range(100):
+            try:
+                _, writer = await asyncio.open_connection(host, port)
+            except OSError:
+                await asyncio.sleep(0.05)
+                continue
+            writer.close()
+            return self.base_url
+        raise RuntimeError(f"hypercorn did not start on {self.base_url}")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._server is not None:
+            self._shutdown.set()
+            await self._server
+
+    async def asgi_app(self, scope, receive, send):
+        """The same pages as an ASGI app, for hypercorn."""
+        if scope["type"] != "http":
+            return
+        path = scope["path"]
+        query_string = scope["query_string"].decode()
+        headers = {name.decode(): value.decode() for name, value in scope["headers"]}
+
+        async def respond(status, body=b"", content_type="text/html", extra=()):
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", content_type.encode()), *extra]})
+            await send({"type": "http.response.body", "body": body})
+
+        if path == "/__hits":
+            return await respond(200, json.dumps(self.hits_report()).encode(), "application/json")
+        self.connections.add(tuple(scope["client"]))
+        refusal = await self._admit(path, headers, f"{self.base_url}{path}")
+        if refusal is not None:
+            status, extra = refusal
+            return await respond(status, extra=[(name.lower().encode(), value.encode()) for name, value in extra.items()])
+        match = ASGI_PATH_RE.match(path)
+        if path == "/request-a-title":
+            return await respond(200, self.request_a_title_page().encode())
+        if match is None:
+            return await respond(404, b"not found", "text/plain")
+        if match["kind"] == "iframe":
+            return await respond(200, self.iframe_page(match["id"]).encode())
+        if match["kind"] != "playlist":
+            return await respond(200, self.embed_page(match["id"]).encode())
+        query = {key: values[0] for key, values in parse_qs(query_string).items()}
+        if "type" not in query:
+            return await respond(200, self.master_page(match["id"], query_string).encode(), "application/vnd.apple.mpegurl")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"application/vnd.apple.mpegurl")]})
+        async for chunk in self.media_chunks(int(query.get("segments", self.segments)), query.get("rendition", "720p")):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def report_hits(self, request):
+        return web.json_response(self.hits_report())
+
+    def hits_report(self):
+        """Upstream request counts, grouped by page kind, and connections accepted."""
+        kinds = Counter()
+        for path, count in self.hits.items():
+            kinds[path.split("/")[1]] += count
+        return {"total": sum(kinds.values()), **kinds, "connections": len(self.connections)}
+
+    async def request_a_title(self, request):
+        return web.Response(text=self.request_a_title_page(), content_type="text/html")
+
+    async def iframe(self, request):
+        return web.Response(text=self.iframe_page(request.match_info["id"]), content_type="text/html")
+
+    async def embed(self, request):
+        return web.Response(text=self.embed_page(request.match_info["id"]), content_type="text/html")
+
+    def request_a_title_page(self):
+        page = json.dumps({"component": "RequestATitle", "props": {}, "url": "/request-a-title", "version": self.version})
+        return f'<html><head></head><body><div id="app" data-page="{html.escape(page)}"></div></body></html>'
+
+    def iframe_page(self, video_id):
+        src = f"{self.base_url}/embed/{video_id}?token=abc&amp;canPlayFHD=1"
+        return f'<html><body><div class="player"><iframe src="{src}" allowfullscreen></iframe></div></body></html>'
+
+    def embed_page(self, video_id):
+        expires = int(time.time()) + 3600
+        script = (
+            "window.video = {\"id\": %s};\n"
+            "window.masterPlaylist = {\n"
+            "    params: {\n"
+            "        'token': 'a1b2c3d4e5f6',\n"
+            "        'expires': '%d',\n"
+            "    },\n"
+            "    url: '%s/playlist/%s?b=1',\n"
+            "}\n"
+            "window.canPlayFHD = true\n"
+        ) % (video_id, expires, self.base_url, video_id)
+        return f"<html><head><title>embed</title></head><body><script>{script}</script></body></html>"
+
+    async def playlist(self, request):
+        if "type" in request.query:
+            return await self.media(request)
+        return await self.master(request)
+
+    async def master(self, request):
+        body = self.master_page(request.match_info["id"], request.query_string)
+        return web.Response(text=body, content_type="application/vnd.apple.mpegurl")
+
+    def master_page(self, video_id, query):
+        lines = ["#EXTM3U"]
+        lines.append(f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="Italian",LANGUAGE="ita",DEFAULT=YES,URI="/playlist/{video_id}?type=audio&rendition=ita&{query}"')
+        lines.append(f'#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subs",NAME="English",LANGUAGE="eng",URI="/playlist/{video_id}?type=subtitle&rendition=eng&{query}"')
+        for height, bandwidth in ((480, 1200000), (720, 2150000), (1080, 4500000)):
+            lines.append(f'#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},CODECS="avc1.640028,mp4a.40.2",RESOLUTION={height * 16 // 9}x{height},AUDIO="audio",SUBTITLES="subs"')
+            lines.append(f"{self.base_url}/playlist/{video_id}?type=video&rendition={height}p&{query}")
+        return "\n".join(lines) + "\n"
+
+    async def media(self, request):
+        segments = int(request.query.get("segments", self.segments))
+        rendition = request.query.get("rendition", "720p")
+        response = web.StreamResponse(headers={"Content-Type": "application/vnd.apple.mpegurl"})
+        await response.prepare(request)
+        async for chunk in self.media_chunks(segments, rendition):
+            await response.write(chunk)
+        await response.write_eof()
+        return response
+
+    async def media_chunks(self, segments, rendition):
+        """Media playlist body, 250 segments per chunk, `chunk_delay` apart."""
+        yield (
+            b"#EXTM3U\n#EXT-X-VERSION:3\n#EXT-X-TARGETDURATION:4\n#EXT-X-MEDIA-SEQUENCE:0\n"
+            b"#EXT-X-PLAYLIST-TYPE:VOD\n"
+            b'#EXT-X-KEY:METHOD=AES-128,URI="/storage/enc.key",IV=0x43A6D967D5C17290D98322F5C8F6660B\n'
+        )
+        for start in range(0, segments, 250):
+            yield "".join(
+                f"#EXTINF:4.000000,\nseg-{n}-v1-a1.ts?rendition={rendition}\n"
+                for n in range(start, min(start + 250, segments))
+            ).encode()
+            if self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        yield b"#EXT-X-ENDLIST\n"
+
+
+async def _serve(args):
+    origin = FakeOrigin(latency=args.latency, tail_ratio=args.tail_ratio, tail_latency=args.tail_latency)
+    if args.certfile:
+        base_url = await origin.start_tls(args.certfile, args.keyfile, alpn=args.alpn.split(","), port=args.port)
+    else:
+        base_url = await origin.start(port=args.port)
+    print(f"fake origin listening on {base_url}", flush=True)
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in VixCloud origin")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.0, help="artificial delay per request in seconds")
+    parser.add_argument("--tail-ratio", type=float, default=0.0, help="share of requests given extra latency")
+    parser.add_argument("--tail-latency", type=float, default=0.0, help="extra delay for those requests in seconds")
+    parser.add_argument("--certfile", help="serve HTTPS through hypercorn with this certificate")
+    parser.add_argument("--keyfile", help="private key for --certfile")
+    parser.add_argument("--alpn", default="h2,http/1.1", help="protocols offered over HTTPS")
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,169 @@
+"""Reproducible load test for /api/v1/vixcloud/manifest against a local origin.
+
+Starts the stand-in VixCloud origin (fake_origin.py) and the extractor in
+Flask (threaded werkzeug) and/or ASGI (uvicorn) mode, each in its own
+subprocess. Then drives the manifest endpoint at each requested concurrency
+level and reports throughput, p50/p95/p99 latency, errors, the extractor's
+RSS (current and peak) and how many upstream requests the run caused.
+
+    python bench/loadtest.py --modes asgi --concurrency 10 100 500 --requests 2000
+    python bench/loadtest.py --titles 500 --kind iframe --cold
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXTRACTOR_DIR = os.path.join(HERE, "..")
+
+SERVERS = {
+    "flask": "from werkzeug.serving import run_simple; import main; run_simple('127.0.0.1', {port}, main.app, threaded=True)",
+    "asgi": "import uvicorn, main; uvicorn.run(main.asgi_app, host='127.0.0.1', port={port}, log_level='warning', backlog=4096)",
+}
+
+TITLE_PATHS = {
+    "iframe": "/iframe/{id}",
+    "movie": "/movie/{id}",
+    "tv": "/tv/{id}/1/1",
+}
+
+
+def spawn(args, cwd, env=None):
+    return subprocess.Popen([sys.executable, *args], cwd=cwd, env={**os.environ, **(env or {})},
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def rss_kib(pid):
+    """Current and peak resident set size of a process, from /proc (Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            fields = dict(line.split(":", 1) for line in status)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+async def wait_until_up(session, url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                return
+        except aiohttp.ClientError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up")
+
+
+async def upstream_hits(session, origin_url):
+    async with session.get(f"{origin_url}/__hits") as response:
+        return await response.json()
+
+
+async def drive(session, urls, concurrency, total):
+    """Send `total` requests over `concurrency` workers; return latencies, errors, elapsed."""
+    latencies = []
+    errors = 0
+    remaining = iter(range(total))
+
+    async def worker():
+        nonlocal errors
+        for n in remaining:
+            start = time.perf_counter()
+            try:
+                async with session.get(urls[n % len(urls)]) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - start
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(mode, concurrency, latencies, errors, elapsed, rss, upstream):
+    latencies.sort()
+    current, peak = rss
+    memory = f"{current / 1024:6.1f} MiB (peak {peak / 1024:6.1f})" if current else "n/a"
+    print(f"{mode:<6} {concurrency:>6} {len(latencies) / elapsed:9.1f} "
+          f"{percentile(latencies, 0.50):9.1f} {percentile(latencies, 0.95):9.1f} {percentile(latencies, 0.99):9.1f} "
+          f"{errors:>7} {upstream:>9}   {memory}")
+
+
+async def run_mode(session, mode, args, origin_url):
+    env = {
+        "EXTRACTOR_POOL_LIMIT": str(args.pool),
+        "EXTRACTOR_POOL_LIMIT_PER_HOST": str(args.pool),
+    }
+    if args.cold:
+        env.update({"EXTRACTOR_VERSION_TTL": "0", "EXTRACTOR_MANIFEST_CACHE_SIZE": "0", "EXTRACTOR_RENDERED_CACHE_SIZE": "0"})
+    server = spawn(["-c", SERVERS[mode].format(port=args.port)], EXTRACTOR_DIR, env)
+    try:
+        endpoint = f"http://127.0.0.1:{args.port}/api/v1/vixcloud/manifest"
+        query = "&prefetch=1" if args.prefetch else ""
+        ids = random.Random(args.seed).sample(range(100000, 999999), args.titles)
+        urls = [f"{endpoint}?url={origin_url}{TITLE_PATHS[args.kind].format(id=i)}{query}" for i in ids]
+        await wait_until_up(session, f"{endpoint}?url={origin_url}/movie/1")
+        if args.warmup:
+            await drive(session, urls, min(args.concurrency), args.warmup)
+        for concurrency in args.concurrency:
+            before = (await upstream_hits(session, origin_url))["total"]
+            result = await drive(session, urls, concurrency, args.requests)
+            upstream = (await upstream_hits(session, origin_url))["total"] - before
+            report(mode, concurrency, *result, rss_kib(server.pid), upstream)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run(args):
+    origin = spawn([
+        "fake_origin.py", "--port", str(args.origin_port), "--latency", str(args.latency),
+    ], HERE)
+    origin_url = f"http://127.0.0.1:{args.origin_port}"
+    connector = aiohttp.TCPConnector(limit=max(args.concurrency))
+    timeout = aiohttp.ClientTimeout(total=120)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            await wait_until_up(session, f"{origin_url}/__hits")
+            print(f"{args.requests} requests per level over {args.titles} {args.kind} title(s), "
+                  f"origin latency {args.latency * 1000:.0f} ms{', caches off' if args.cold else ''}"
+                  f"{', prefetch on' if args.prefetch else ''}")
+            print(f"{'mode':<6} {'conc':>6} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+                  f"{'errors':>7} {'upstream':>9}   rss")
+            for mode in args.modes:
+                await run_mode(session, mode, args, origin_url)
+    finally:
+        origin.terminate()
+        origin.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--modes", nargs="+", choices=sorted(SERVERS), default=["flask", "asgi"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[200], help="one or more levels to sweep")
+    parser.add_argument("--requests", type=int, default=2000, help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=100, help="requests sent before measuring")
+    parser.add_argument("--titles", type=int, default=1, help="distinct titles to spread requests over")
+    parser.add_argument("--kind", choices=sorted(TITLE_PATHS), default="iframe")
+    parser.add_argument("--latency", type=float, default=0.05, help="artificial origin latency in seconds")
+    parser.add_argument("--cold", action="store_true", help="disable the extractor caches")
+    parser.add_argument("--prefetch", action="store_true", help="request manifests with prefetch=1")
+    parser.add_argument("--pool", type=int, default=200, help="upstream pool size (total and per host)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--origin-port", type=int, default=8081)
+    asyncio.run(run(parser.parse_args()))
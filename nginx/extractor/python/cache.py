@@ -0,0 +1,273 @@
+"""Cache backends for the extractor.
+
+A cache maps string keys to string (or bytes) values that expire at an absolute Unix
+time, and holds at most `max_size` entries, least recently used first out.
+
+MemoryCache lives in one process. SQLiteCache keeps entries in a SQLite
+database in WAL mode, so every worker process on the host shares the same
+hits. Expiry and the size limit are enforced in the database itself, every
+EXTRACTOR_CACHE_TRIM_EVERY writes.
+
+Code on the event loop uses the async methods (aget, aset, adelete,
+acontains, astats). SQLiteCache runs them on one thread per database, so a
+write waiting on another worker's lock never stalls the loop.
+
+Pick one with EXTRACTOR_CACHE_BACKEND=memory|sqlite; the database file is
+EXTRACTOR_CACHE_PATH.
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_BACKEND = os.environ.get("EXTRACTOR_CACHE_BACKEND", "memory")
+CACHE_PATH = os.environ.get("EXTRACTOR_CACHE_PATH", "/tmp/vixcloud-extractor-cache.sqlite3")
+# SQLite entries past their expiry or the size limit are deleted once per this many writes
+TRIM_EVERY = int(os.environ.get("EXTRACTOR_CACHE_TRIM_EVERY", "100"))
+
+
+class MemoryCache:
+    """Bounded in-process LRU cache."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key):
+        entry = self.entries.get(key)
+        return entry is not None and entry[1] > time.time()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expires_at):
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        return self.entries.pop(key, None) is not None
+
+    def size(self):
+        return len(self.entries)
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": self.size(),
+        }
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value, expires_at):
+        self.set(key, value, expires_at)
+
+    async def adelete(self, key):
+        return self.delete(key)
+
+    async def acontains(self, key):
+        return key in self
+
+    async def astats(self):
+        return self.stats()
+
+
+_connections = {}
+_executors = {}
+_connections_lock = threading.Lock()
+
+
+def executor(path):
+    """The thread that owns a database's connection in this process, started after any fork."""
+    key = (path, os.getpid())
+    with _connections_lock:
+        if key not in _executors:
+            _executors[key] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-sqlite")
+        return _executors[key]
+
+
+def connect(path):
+    """One connection per database per process, opened after any fork.
+
+    Only used from the database's executor() thread.
+    """
+    key = (path, os.getpid())
+    with _connections_lock:
+        connection = _connections.get(key)
+        if connection is None:
+            connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " namespace TEXT NOT NULL,"
+                " key TEXT NOT NULL,"
+                " value TEXT NOT NULL,"
+                " expires_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, key)"
+                ") WITHOUT ROWID"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed_at)")
+            _connections[key] = connection
+        return connection
+
+
+class SQLiteCache:
+    """LRU cache shared by every process using the same database file.
+
+    Reads only refresh an entry's recency every `touch_interval` seconds, so
+    a hot key does not turn every hit into a write. Every call runs on the
+    database's own thread, in order: the sync methods wait for it, the async
+    ones let the event loop carry on. Expired and least recently used
+    entries are trimmed every `trim_every` writes rather than on each one,
+    so the table can briefly hold that many entries over `max_size`.
+    """
+
+    def __init__(self, path, namespace, max_size, touch_interval=10, trim_every=TRIM_EVERY):
+        self.path = path
+        self.namespace = namespace
+        self.max_size = max_size
+        self.touch_interval = touch_interval
+        self.trim_every = max(trim_every, 1)
+        self.writes = 0
+        # Entry count as of the last trim or stats, so size() never touches the database
+        self.count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def db(self):
+        return connect(self.path)
+
+    def run(self, function, *args):
+        return executor(self.path).submit(function, *args).result()
+
+    async def run_async(self, function, *args):
+        return await asyncio.wrap_future(executor(self.path).submit(function, *args))
+
+    def _contains(self, key):
+        row = self.db.execute(
+            "SELECT 1 FROM cache WHERE namespace = ? AND key = ? AND expires_at > ?",
+            (self.namespace, key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def _get(self, key):
+        now = time.time()
+        row = self.db.execute(
+            "SELECT value, expires_at, accessed_at FROM cache WHERE namespace = ? AND key = ?",
+            (self.namespace, key),
+        ).fetchone()
+        if row is None or row[1] <= now:
+            self.misses += 1
+            return None
+        if row[2] < now - self.touch_interval:
+            self.db.execute(
+                "UPDATE cache SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (now, self.namespace, key),
+            )
+        self.hits += 1
+        return row[0]
+
+    def _set(self, key, value, expires_at):
+        self.db.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (self.namespace, key, value, expires_at, time.time()),
+        )
+        self.writes += 1
+        if self.writes % self.trim_every == 0:
+            self._trim()
+
+    def _trim(self):
+        """Drop expired entries and everything past the size limit, oldest first."""
+        now = time.time()
+        evicted = self.db.execute(
+            "DELETE FROM cache WHERE namespace = ? AND (expires_at <= ? OR key IN ("
+            " SELECT key FROM cache WHERE namespace = ? AND expires_at > ?"
+            " ORDER BY accessed_at DESC LIMIT -1 OFFSET ?))",
+            (self.namespace, now, self.namespace, now, self.max_size),
+        ).rowcount
+        self.evictions += max(evicted, 0)
+        self._count()
+
+    def _delete(self, key):
+        return self.db.execute(
+            "DELETE FROM cache WHERE namespace = ? AND key = ?", (self.namespace, key),
+        ).rowcount > 0
+
+    def _count(self):
+        self.count = self.db.execute("SELECT COUNT(*) FROM cache WHERE namespace = ?", (self.namespace,)).fetchone()[0]
+        return self.count
+
+    def __contains__(self, key):
+        return self.run(self._contains, key)
+
+    def get(self, key):
+        return self.run(self._get, key)
+
+    def set(self, key, value, expires_at):
+        self.run(self._set, key, value, expires_at)
+
+    def delete(self, key):
+        return self.run(self._delete, key)
+
+    def size(self):
+        return self.count
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": self.size(),
+        }
+
+    async def aget(self, key):
+        return await self.run_async(self._get, key)
+
+    async def aset(self, key, value, expires_at):
+        await self.run_async(self._set, key, value, expires_at)
+
+    async def adelete(self, key):
+        return await self.run_async(self._delete, key)
+
+    async def acontains(self, key):
+        return await self.run_async(self._contains, key)
+
+    async def astats(self):
+        await self.run_async(self._count)
+        return self.stats()
+
+
+def open_cache(namespace, max_size, backend=None, path=None):
+    """Cache for one kind of entry, on the configured backend."""
+    backend = backend or CACHE_BACKEND
+    if backend == "memory":
+        return MemoryCache(max_size)
+    if backend == "sqlite":
+        return SQLiteCache(path or CACHE_PATH, namespace, max_size)
+    raise ValueError(f"Unknown cache backend: {backend}")
@@ -0,0 +1,113 @@
+"""Flask front end of the extractor: the same API as main.asgi_app.
+
+Kept apart from main so the ASGI server never imports Flask. `main.app`
+still works and loads this module on first access.
+"""
+from flask import Flask, Response, request, jsonify, redirect
+from flask_cors import CORS
+
+import metrics
+from main import (
+    BATCH_MAX_URLS, COMPACT_PLAYLISTS, MANIFEST_CONTENT_TYPE, NGINX_PROXY_BASE, PREFETCH_VARIANTS,
+    RenditionFilter, batch_urls, error_status, extract_batch, extractor_stats, fetch_compact_manifest,
+    fetch_prefetched_manifest, flag, get_compact_playlist, get_prefetched_playlist, iter_async, open_manifest,
+    pick_encoding, render_metrics, rendered_key, resolve_token, respond_cached, respond_rendered,
+    rewrite_manifest_stream, run_async, start_prewarm, tee_rendered, token_redirect_headers, with_deadline,
+)
+
+app = Flask(__name__)
+CORS(app)
+
+@app.route('/api/v1/vixcloud/manifest', methods=['GET'])
+def get_manifest():
+    """Extract VixCloud manifest and rewrite URLs."""
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"error": "Missing URL parameter"}), 400
+    try:
+        renditions = RenditionFilter.from_query(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    compact = flag(request.args.get('compact'), COMPACT_PLAYLISTS)
+    key = rendered_key('manifest', request.args)
+    encoding = pick_encoding(request.headers.get('Accept-Encoding'))
+    if_none_match = request.headers.get('If-None-Match')
+    try:
+        if flag(request.args.get('prefetch'), PREFETCH_VARIANTS):
+            # Not cached: serving it also starts the variant prefetch
+            text = run_async(with_deadline(fetch_prefetched_manifest(url, renditions, compact)))
+            return manifest_response(*run_async(respond_rendered(None, text, encoding, if_none_match)))
+        cached = run_async(respond_cached(key, encoding, if_none_match))
+        if cached is not None:
+            return manifest_response(*cached)
+        if compact:
+            text = run_async(with_deadline(fetch_compact_manifest(url, renditions)))
+            return manifest_response(*run_async(respond_rendered(key, text, encoding, if_none_match)))
+        manifest_url, stream = run_async(with_deadline(open_manifest(url)))
+    except Exception as e:
+        return jsonify({"error": str(e)}), error_status(e)
+    
+    # Rewrite URLs for nginx proxy while the body streams in; later
+    # requests get the rendered copy, compressed and with an ETag
+    chunks = tee_rendered(rewrite_manifest_stream(stream, manifest_url, renditions), key)
+    return Response(iter_async(chunks), 200, {'Content-Type': MANIFEST_CONTENT_TYPE})
+
+def manifest_response(status, body, headers):
+    return Response(body, status, {**headers, 'Content-Type': MANIFEST_CONTENT_TYPE})
+
+@app.route('/api/v1/vixcloud/manifest/batch', methods=['POST'])
+def post_manifest_batch():
+    """Resolve many VixCloud URLs, streaming results back as NDJSON."""
+    urls = batch_urls(request.get_json(silent=True))
+    if urls is None:
+        return jsonify({"error": f"Body must be {{\"urls\": [...]}} with 1 to {BATCH_MAX_URLS} URLs"}), 400
+    return Response(iter_async(extract_batch(urls)), 200, {'Content-Type': 'application/x-ndjson'})
+
+@app.route('/api/v1/vixcloud/playlist', methods=['GET'])
+def get_playlist():
+    """Serve a prefetched variant playlist, or send the player to nginx.
+
+    Compact playlists (?compact=1) are never left to nginx: on a prefetch
+    miss they are fetched and tokenised here.
+    """
+    url = request.args.get('url')
+    if not url:
+        return jsonify({"error": "Missing URL parameter"}), 400
+    
+    key = rendered_key('playlist', request.args)
+    encoding = pick_encoding(request.headers.get('Accept-Encoding'))
+    if_none_match = request.headers.get('If-None-Match')
+    cached = run_async(respond_cached(key, encoding, if_none_match))
+    if cached is not None:
+        return manifest_response(*cached)
+    if flag(request.args.get('compact'), False):
+        try:
+            playlist = run_async(with_deadline(get_compact_playlist(url)))
+        except Exception as e:
+            return jsonify({"error": str(e)}), error_status(e)
+    else:
+        playlist = run_async(get_prefetched_playlist(url))
+        if playlist is None:
+            return redirect(f"{NGINX_PROXY_BASE}{url}")
+    return manifest_response(*run_async(respond_rendered(key, playlist, encoding, if_none_match)))
+
+@app.route('/api/v1/vixcloud/t/<table>/<index>', methods=['GET'])
+def get_token(table, index):
+    """Resolve a compact playlist token to its proxied URL."""
+    url = run_async(resolve_token(table, index))
+    if url is None:
+        return jsonify({"error": "Unknown or expired token, reload the playlist"}), 404
+    return Response(status=302, headers=token_redirect_headers(url))
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus metrics for this process."""
+    return Response(run_async(render_metrics()), 200, {'Content-Type': metrics.CONTENT_TYPE})
+
+@app.route('/api/v1/vixcloud/stats', methods=['GET'])
+def get_stats():
+    """Cache counters for this process."""
+    return jsonify(run_async(extractor_stats()))
+
+start_prewarm()
@@ -1,28 +1,738 @@
+import atexit
+import base64
+import contextvars
+import gzip
+import hashlib
+import html
 import json
+import logging
+import os
 import re
+import sys
+import threading
+import time
 import aiohttp
 import asyncio
-from urllib.parse import urlparse, urljoin
-from bs4 import BeautifulSoup, SoupStrainer
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from collections import deque
+from urllib.parse import urlparse, urljoin, parse_qs, quote
+import cache
+import metrics
 
-app = Flask(__name__)
-CORS(app)
+try:
+    import brotli
+except ImportError:
+    # Optional: without it responses are offered as gzip or identity only
+    brotli = None
+# Optional httpx and h2, imported by load_httpx() the first time EXTRACTOR_HTTP2 is used
+httpx = None
+httpx_missing = False
+
+logger = logging.getLogger(__name__)
 
 NGINX_PROXY_BASE = "http://localhost:8080/proxy/?url="
+MANIFEST_CONTENT_TYPE = 'application/vnd.apple.mpegurl'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
 
-async def make_request(url, headers=None):
-    """Simple HTTP request."""
+# Upstream connection pool, shared by every request handled by this process
+POOL_LIMIT = int(os.environ.get("EXTRACTOR_POOL_LIMIT", "100"))
+POOL_LIMIT_PER_HOST = int(os.environ.get("EXTRACTOR_POOL_LIMIT_PER_HOST", "10"))
+DNS_CACHE_TTL = int(os.environ.get("EXTRACTOR_DNS_CACHE_TTL", "300"))
+KEEPALIVE_TIMEOUT = float(os.environ.get("EXTRACTOR_KEEPALIVE_TIMEOUT", "60"))
+CONNECT_TIMEOUT = float(os.environ.get("EXTRACTOR_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.environ.get("EXTRACTOR_READ_TIMEOUT", "20"))
+TOTAL_TIMEOUT = float(os.environ.get("EXTRACTOR_TIMEOUT", "30"))
+
+# Opt-in HTTP/2 upstream (needs httpx and h2): requests to an https host share one multiplexed connection
+HTTP2 = os.environ.get("EXTRACTOR_HTTP2", "0") == "1"
+
+# End-to-end budget for one extraction, shared by all of its upstream calls
+DEADLINE = float(os.environ.get("EXTRACTOR_DEADLINE", "20"))
+
+# Hedged upstream GETs: once a host's observed p95 passes without an answer,
+# send one duplicate request, for at most HEDGE_MAX_RATIO of requests
+HEDGING = os.environ.get("EXTRACTOR_HEDGING", "1") == "1"
+HEDGE_QUANTILE = float(os.environ.get("EXTRACTOR_HEDGE_QUANTILE", "0.95"))
+HEDGE_MIN_DELAY = float(os.environ.get("EXTRACTOR_HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MAX_RATIO = float(os.environ.get("EXTRACTOR_HEDGE_MAX_RATIO", "0.1"))
+HEDGE_WINDOW = int(os.environ.get("EXTRACTOR_HEDGE_WINDOW", "200"))
+
+# Failed extractions are remembered per URL for this long
+NEGATIVE_TTL = float(os.environ.get("EXTRACTOR_NEGATIVE_TTL", "30"))
+NEGATIVE_CACHE_SIZE = int(os.environ.get("EXTRACTOR_NEGATIVE_CACHE_SIZE", "1024"))
+
+# Upstream hosts failing this many times in a row are skipped for a cooldown
+BREAKER_FAILURES = int(os.environ.get("EXTRACTOR_BREAKER_FAILURES", "5"))
+BREAKER_COOLDOWN = float(os.environ.get("EXTRACTOR_BREAKER_COOLDOWN", "30"))
+
+# How long a site's inertia version is trusted before it is fetched again
+VERSION_TTL = float(os.environ.get("EXTRACTOR_VERSION_TTL", "3600"))
+VERSION_CACHE_SIZE = int(os.environ.get("EXTRACTOR_VERSION_CACHE_SIZE", "64"))
+
+# Resolved manifest URLs are reused until `expires` minus this margin
+MANIFEST_CACHE_SIZE = int(os.environ.get("EXTRACTOR_MANIFEST_CACHE_SIZE", "2048"))
+MANIFEST_EXPIRY_MARGIN = float(os.environ.get("EXTRACTOR_MANIFEST_EXPIRY_MARGIN", "300"))
+
+# Variant/audio/subtitle playlists fetched right after the master (?prefetch=1)
+PREFETCH_VARIANTS = os.environ.get("EXTRACTOR_PREFETCH_VARIANTS", "0") == "1"
+PREFETCH_TTL = float(os.environ.get("EXTRACTOR_PREFETCH_TTL", "30"))
+PREFETCH_CACHE_SIZE = int(os.environ.get("EXTRACTOR_PREFETCH_CACHE_SIZE", "512"))
+
+# Compact playlists (?compact=1): segment and key URLs become short tokens that
+# /api/v1/vixcloud/t/<table>/<index> resolves. With EXTRACTOR_TOKEN_ACCEL=1 the
+# resolver answers with X-Accel-Redirect, so an nginx in front proxies the
+# segment itself instead of bouncing the player through a redirect.
+COMPACT_PLAYLISTS = os.environ.get("EXTRACTOR_COMPACT_PLAYLISTS", "0") == "1"
+TOKEN_TTL = float(os.environ.get("EXTRACTOR_TOKEN_TTL", "21600"))
+TOKEN_CACHE_SIZE = int(os.environ.get("EXTRACTOR_TOKEN_CACHE_SIZE", "1024"))
+TOKEN_ACCEL = os.environ.get("EXTRACTOR_TOKEN_ACCEL", "0") == "1"
+
+# Finished manifests are kept with gzip/brotli variants and strong ETags, so
+# repeat requests skip extraction and revalidations get 304. Only masters and
+# VOD playlists are kept; a live playlist changes on every reload.
+RENDERED_TTL = float(os.environ.get("EXTRACTOR_RENDERED_TTL", "300"))
+RENDERED_CACHE_SIZE = int(os.environ.get("EXTRACTOR_RENDERED_CACHE_SIZE", "1536"))
+# A streamed manifest not yet known to be a master or VOD is copied for rendering up to this size
+RENDER_BUFFER_BYTES = int(os.environ.get("EXTRACTOR_RENDER_BUFFER_BYTES", str(256 * 1024)))
+GZIP_LEVEL = int(os.environ.get("EXTRACTOR_GZIP_LEVEL", "9"))
+BROTLI_QUALITY = int(os.environ.get("EXTRACTOR_BROTLI_QUALITY", "9"))
+
+# Batch extraction: parallel extractions and upstream starts per second per host
+BATCH_CONCURRENCY = int(os.environ.get("EXTRACTOR_BATCH_CONCURRENCY", "8"))
+BATCH_HOST_RATE = float(os.environ.get("EXTRACTOR_BATCH_HOST_RATE", "5"))
+BATCH_MAX_URLS = int(os.environ.get("EXTRACTOR_BATCH_MAX_URLS", "5000"))
+
+# Startup prewarm: sites (comma separated) whose connection and inertia version are fetched before serving
+PREWARM_SITES = [site for site in os.environ.get("EXTRACTOR_PREWARM_SITES", "").split(",") if site]
+PREWARM_TIMEOUT = float(os.environ.get("EXTRACTOR_PREWARM_TIMEOUT", "5"))
+
+STAGE_SECONDS = metrics.Histogram(
+    "extractor_stage_seconds", "Time spent in each extraction stage", ["stage"])
+UPSTREAM_RESPONSES = metrics.Counter(
+    "extractor_upstream_responses_total", "Upstream responses by host and status", ["host", "status"])
+UPSTREAM_ERRORS = metrics.Counter(
+    "extractor_upstream_errors_total", "Upstream requests that failed without a response", ["host", "error"])
+UPSTREAM_IN_FLIGHT = metrics.Gauge(
+    "extractor_upstream_in_flight", "Upstream requests in progress")
+EXTRACTIONS = metrics.Counter(
+    "extractor_extractions_total", "Manifest URL scrapes by result", ["result"])
+EXTRACTIONS_IN_FLIGHT = metrics.Gauge(
+    "extractor_extractions_in_flight", "Manifest URL scrapes in progress")
+HEDGED_REQUESTS = metrics.Counter(
+    "extractor_hedged_requests_total", "Duplicate upstream requests sent, and how many answered first", ["result"])
+DEADLINES_EXCEEDED = metrics.Counter(
+    "extractor_deadlines_exceeded_total", "Extractions that ran out of their end-to-end budget")
+BREAKER_REJECTIONS = metrics.Counter(
+    "extractor_breaker_rejections_total", "Upstream calls refused because the host's breaker is open", ["host"])
+RENDITIONS_DROPPED = metrics.Counter(
+    "extractor_renditions_dropped_total", "Master playlist entries removed by rendition filters", ["type"])
+VERSION_CONFLICTS = metrics.Counter(
+    "extractor_version_conflicts_total", "Inertia 409 answers that forced a version refresh")
+HTTP2_FALLBACKS = metrics.Counter(
+    "extractor_http2_fallbacks_total", "Upstream requests the HTTP/2 transport handed to HTTP/1.1", ["host", "reason"])
+
+# One session and one background loop per process, keyed by pid like
+# cache.executor(): a worker forked after import (gunicorn --preload with
+# prewarm on) inherits neither the loop's thread nor usable connections
+_sessions = {}
+_loops = {}
+_loop_lock = threading.Lock()
+
+def get_session():
+    """Return this process's long-lived upstream session, creating it on first use.
+
+    Must be called from the event loop that will use the session.
+    """
+    session = _sessions.get(os.getpid())
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=POOL_LIMIT,
+            limit_per_host=POOL_LIMIT_PER_HOST,
+            use_dns_cache=True,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=TOTAL_TIMEOUT,
+            connect=CONNECT_TIMEOUT,
+            sock_read=READ_TIMEOUT,
+        )
+        session = _sessions[os.getpid()] = aiohttp.ClientSession(connector=connector, timeout=timeout)
+    return session
+
+def get_loop():
+    """Return this process's background event loop, which the sync routes run coroutines on."""
+    pid = os.getpid()
+    with _loop_lock:
+        if pid not in _loops:
+            _loops[pid] = asyncio.new_event_loop()
+            threading.Thread(target=_loops[pid].run_forever, name="extractor-loop", daemon=True).start()
+        return _loops[pid]
+
+def run_async(coro):
+    """Run a coroutine on the background loop and wait for the result."""
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+def __getattr__(name):
+    """Load the Flask app on first access to `main.app`, so ASGI never imports Flask."""
+    if name == "app":
+        import flask_app
+        return flask_app.app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+async def close_upstream():
+    """Close this process's aiohttp pool and HTTP/2 client, if open."""
+    session = _sessions.get(os.getpid())
+    if session is not None and not session.closed:
+        await session.close()
+    await http2_upstream.close()
+
+@atexit.register
+def close_session():
+    """Close pooled upstream connections on shutdown."""
+    if os.getpid() in _loops:
+        run_async(close_upstream())
+
+def with_user_agent(headers):
+    """Default request headers shared by every upstream call."""
     if headers is None:
         headers = {}
     
     if 'User-Agent' not in headers:
-        headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+        headers['User-Agent'] = USER_AGENT
+    return headers
+
+class ExtractionError(Exception):
+    """A VixCloud page was missing or did not have the expected shape."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+class InvalidUrl(ValueError):
+    """The URL is not a VixCloud iframe, movie or tv URL."""
+
+class HostUnavailable(Exception):
+    """The upstream host's circuit breaker is open."""
+
+class DeadlineExceeded(TimeoutError):
+    """The extraction's end-to-end budget ran out."""
+
+# Transport failures of either upstream client; load_httpx() adds httpx's
+UPSTREAM_EXCEPTIONS = (aiohttp.ClientError,)
+
+def load_httpx():
+    """Import httpx and h2 on first use; None when they are not installed.
+
+    Without them EXTRACTOR_HTTP2 is ignored and all upstream traffic uses aiohttp.
+    """
+    global httpx, httpx_missing, UPSTREAM_EXCEPTIONS
+    if httpx is None and not httpx_missing:
+        try:
+            import httpx as module
+            import h2  # noqa: F401  (httpx's HTTP/2 support)
+        except ImportError:
+            httpx_missing = True
+            return None
+        httpx = module
+        UPSTREAM_EXCEPTIONS = (aiohttp.ClientError, httpx.HTTPError)
+    return httpx
+
+def error_status(e):
+    """HTTP status to answer a failed extraction with."""
+    if isinstance(e, InvalidUrl):
+        return 400
+    if isinstance(e, DeadlineExceeded):
+        return 504
+    if isinstance(e, HostUnavailable):
+        return 503
+    if isinstance(e, (ExtractionError, *UPSTREAM_EXCEPTIONS)):
+        return 502
+    return 500
+
+# Absolute time.monotonic() by which the current extraction must finish
+deadline_at = contextvars.ContextVar("deadline_at", default=None)
+
+async def with_deadline(coro, budget=None):
+    """Await `coro` with every upstream call it makes sharing one budget."""
+    budget = DEADLINE if budget is None else budget
+    deadline = time.monotonic() + budget
+    token = deadline_at.set(deadline)
+    try:
+        # wait_for runs coro in a task that copies this context, deadline included
+        return await asyncio.wait_for(coro, budget)
+    except TimeoutError as e:
+        # A single call timing out early is not the deadline
+        if isinstance(e, DeadlineExceeded) or time.monotonic() < deadline:
+            raise
+        DEADLINES_EXCEEDED.inc()
+        raise DeadlineExceeded(f"Extraction exceeded its {budget:g}s deadline") from e
+    finally:
+        deadline_at.reset(token)
+
+def deadline_passed():
+    deadline = deadline_at.get()
+    return deadline is not None and time.monotonic() >= deadline
+
+def upstream_timeout():
+    """Timeout for the next upstream call: what is left of the deadline, at most TOTAL_TIMEOUT."""
+    total = TOTAL_TIMEOUT
+    deadline = deadline_at.get()
+    if deadline is not None:
+        left = deadline - time.monotonic()
+        if left <= 0:
+            DEADLINES_EXCEEDED.inc()
+            raise DeadlineExceeded("Extraction deadline passed before the upstream call")
+        total = min(total, left)
+    return aiohttp.ClientTimeout(total=total, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+
+class LatencyTracker:
+    """Recent upstream response times per host, and the hedge delay they imply."""
+
+    def __init__(self, window, quantile, min_delay, max_ratio):
+        self.window = window
+        self.quantile = quantile
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.samples = {}
+        self.delays = {}
+        self.requests = 0
+        self.hedges = 0
+
+    def observe(self, host, seconds):
+        samples = self.samples.get(host)
+        if samples is None:
+            samples = self.samples[host] = deque(maxlen=self.window)
+        samples.append(seconds)
+        # Re-sort only every few samples; the quantile moves slowly anyway
+        if len(samples) >= 20 and len(samples) % 10 == 0:
+            ordered = sorted(samples)
+            self.delays[host] = max(self.min_delay, ordered[int(len(ordered) * self.quantile)])
+
+    def hedge_delay(self, host):
+        """Seconds to wait before hedging, or None while there is too little data."""
+        self.requests += 1
+        return self.delays.get(host)
+
+    def allow_hedge(self):
+        if self.hedges >= self.max_ratio * self.requests:
+            return False
+        self.hedges += 1
+        return True
+
+upstream_latency = LatencyTracker(HEDGE_WINDOW, HEDGE_QUANTILE, HEDGE_MIN_DELAY, HEDGE_MAX_RATIO)
+
+class CircuitBreaker:
+    """Per-host breaker that fails fast while a host keeps erroring.
+
+    After `threshold` failures in a row (errors, timeouts, 5xx) the host is
+    refused for `cooldown` seconds. Then a single trial call goes through:
+    success closes the breaker, failure opens it for another cooldown.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = {}
+        self.open_until = {}
+        self.trials = set()
+
+    def check(self, host):
+        """Raise HostUnavailable unless a call to `host` may go ahead."""
+        open_until = self.open_until.get(host)
+        if open_until is None:
+            return
+        now = time.monotonic()
+        if now < open_until or host in self.trials:
+            BREAKER_REJECTIONS.inc(host)
+            raise HostUnavailable(f"{host} is failing, retrying in {max(open_until - now, 0):.1f}s")
+        self.trials.add(host)
+
+    def success(self, host):
+        self.failures.pop(host, None)
+        self.open_until.pop(host, None)
+        self.trials.discard(host)
+
+    def failure(self, host):
+        self.trials.discard(host)
+        failures = self.failures.get(host, 0) + 1
+        self.failures[host] = failures
+        if failures >= self.threshold:
+            self.open_until[host] = time.monotonic() + self.cooldown
+
+    def abandon(self, host):
+        """A call ended without an outcome (cancelled); free the trial slot."""
+        self.trials.discard(host)
+
+    def record(self, host, status):
+        if status >= 500:
+            self.failure(host)
+        else:
+            self.success(host)
+
+    def record_error(self, host, error):
+        # Timeouts cut short by our own deadline say nothing about the host
+        if not (isinstance(error, TimeoutError) and deadline_passed()):
+            self.failure(host)
+
+    def stats(self):
+        now = time.monotonic()
+        return {host: "open" if now < until else "half-open" for host, until in self.open_until.items()}
+
+upstream_breaker = CircuitBreaker(BREAKER_FAILURES, BREAKER_COOLDOWN)
+
+class Http2Response:
+    """An httpx response with the part of aiohttp's ClientResponse API used here."""
+
+    def __init__(self, response, timeout):
+        self.response = response
+        self.status = response.status_code
+        self.content = self
+        # httpx only bounds each read; apply the total like aiohttp does
+        self.expires = time.monotonic() + timeout.total
+
+    async def text(self):
+        await asyncio.wait_for(self.response.aread(), self.expires - time.monotonic())
+        return self.response.text
+
+    async def iter_any(self):
+        chunks = self.response.aiter_bytes()
+        while True:
+            try:
+                chunk = await asyncio.wait_for(chunks.__anext__(), self.expires - time.monotonic())
+            except StopAsyncIteration:
+                return
+            yield chunk
+
+    async def release(self):
+        await self.response.aclose()
+
+class Http2Upstream:
+    """Upstream GETs over HTTP/2, multiplexed per host (EXTRACTOR_HTTP2=1).
+
+    The protocol is negotiated per connection through ALPN. A host that
+    answers over HTTP/1.1 goes back to the aiohttp pool from then on. A
+    request caught by a dropped connection (a GOAWAY once the server's
+    per-connection request cap is hit, or a reset) is resent once over
+    HTTP/1.1.
+    """
+
+    def __init__(self):
+        # pid -> client, so a forked worker opens its own connections
+        self.clients = {}
+        self.http1_hosts = set()
+
+    def handles(self, url, host):
+        return HTTP2 and url.startswith("https://") and host not in self.http1_hosts and load_httpx() is not None
+
+    def get_client(self):
+        client = self.clients.get(os.getpid())
+        if client is None or client.is_closed:
+            client = self.clients[os.getpid()] = httpx.AsyncClient(
+                http2=True,
+                limits=httpx.Limits(max_connections=POOL_LIMIT, keepalive_expiry=KEEPALIVE_TIMEOUT),
+                timeout=httpx.Timeout(TOTAL_TIMEOUT, connect=CONNECT_TIMEOUT, read=READ_TIMEOUT),
+            )
+        return client
+
+    async def open(self, url, headers, timeout, host):
+        """Send a GET; the response once its headers arrive, or None to resend it over HTTP/1.1."""
+        client = self.get_client()
+        try:
+            response = await asyncio.wait_for(
+                client.send(client.build_request("GET", url, headers=headers), stream=True), timeout.total)
+        except (httpx.ReadError, httpx.WriteError, httpx.ProtocolError):
+            # A GET is safe to send again on the other transport
+            HTTP2_FALLBACKS.inc(host, "connection_lost")
+            return None
+        if response.http_version != "HTTP/2":
+            self.http1_hosts.add(host)
+            HTTP2_FALLBACKS.inc(host, "no_h2")
+        return Http2Response(response, timeout)
+
+    async def get(self, url, headers, timeout, host):
+        """A whole GET: (status, body), or None to resend it over HTTP/1.1."""
+        response = await self.open(url, headers, timeout, host)
+        if response is None:
+            return None
+        try:
+            return response.status, await response.text()
+        except (httpx.ReadError, httpx.WriteError, httpx.ProtocolError):
+            HTTP2_FALLBACKS.inc(host, "connection_lost")
+            return None
+        finally:
+            await response.release()
+
+    async def close(self):
+        client = self.clients.get(os.getpid())
+        if client is not None:
+            await client.aclose()
+
+    def stats(self):
+        return {"enabled": HTTP2 and load_httpx() is not None, "http1_hosts": sorted(self.http1_hosts)}
+
+http2_upstream = Http2Upstream()
+
+async def open_upstream(url, headers, timeout, host):
+    """Start a streamed GET over HTTP/2 when it is on for the host, else over the aiohttp pool.
+
+    Returns once the response headers arrive; the caller must release it.
+    """
+    if http2_upstream.handles(url, host):
+        response = await http2_upstream.open(url, headers, timeout, host)
+        if response is not None:
+            return response
+    return await get_session().get(url, headers=headers, timeout=timeout)
+
+async def fetch_once(url, headers, host):
+    """One upstream GET, returning (status, body)."""
+    upstream_breaker.check(host)
+    try:
+        timeout = upstream_timeout()
+        start = time.perf_counter()
+        with UPSTREAM_IN_FLIGHT.track():
+            headers = with_user_agent(headers)
+            result = await http2_upstream.get(url, headers, timeout, host) if http2_upstream.handles(url, host) else None
+            if result is None:
+                async with get_session().get(url, headers=headers, timeout=timeout) as response:
+                    result = response.status, await response.text()
+            status, body = result
+            UPSTREAM_RESPONSES.inc(host, str(status))
+    except asyncio.CancelledError:
+        upstream_breaker.abandon(host)
+        raise
+    except DeadlineExceeded:
+        upstream_breaker.abandon(host)
+        raise
+    except Exception as e:
+        UPSTREAM_ERRORS.inc(host, type(e).__name__)
+        upstream_breaker.record_error(host, e)
+        raise
+    upstream_breaker.record(host, status)
+    upstream_latency.observe(host, time.perf_counter() - start)
+    return status, body
+
+async def fetch(url, headers=None):
+    """HTTP GET over the shared connection pool, returning (status, body).
+
+    If the host's observed p95 passes without an answer, one hedged
+    duplicate is sent and whichever answers first is used.
+    """
+    host = urlparse(url).netloc
+    delay = upstream_latency.hedge_delay(host) if HEDGING else None
+    if delay is None:
+        return await fetch_once(url, headers, host)
     
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=30)) as response:
-            return await response.text()
+    hedge = None
+    pending = {asyncio.ensure_future(fetch_once(url, dict(headers or {}), host))}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        if not done and upstream_latency.allow_hedge():
+            HEDGED_REQUESTS.inc("sent")
+            hedge = asyncio.ensure_future(fetch_once(url, dict(headers or {}), host))
+            pending.add(hedge)
+        while True:
+            for task in done:
+                if task.exception() is None:
+                    if task is hedge:
+                        HEDGED_REQUESTS.inc("won")
+                    return task.result()
+                error = task.exception()
+            if not pending:
+                raise error
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def make_request(url, headers=None):
+    """Simple HTTP request."""
+    return (await fetch(url, headers))[1]
+
+def require_ok(url, status):
+    """Raise ExtractionError for a page that did not come back 2xx."""
+    if status >= 400:
+        raise ExtractionError(f"{url} answered HTTP {status}", status)
+
+async def fetch_page(url, headers=None):
+    """Body of a page the scraper needs, which must exist."""
+    status, body = await fetch(url, headers)
+    require_ok(url, status)
+    return body
+
+# Shared by every worker when EXTRACTOR_CACHE_BACKEND=sqlite (see cache.py)
+version_cache = cache.open_cache("version", VERSION_CACHE_SIZE)
+manifest_cache = cache.open_cache("manifest", MANIFEST_CACHE_SIZE)
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one running task."""
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def do(self, key, fn):
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.coalesced += 1
+        # A caller that goes away must not cancel the work others wait on
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        self.calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        return {"in_flight": len(self.calls), "coalesced": self.coalesced}
+
+version_flight = SingleFlight()
+manifest_flight = SingleFlight()
+
+class ManifestStream:
+    """Upstream playlist body, read once and shared line by line.
+
+    `open` returns as soon as the response headers arrive, or raises
+    ExtractionError if they carry an error status. A background task then
+    appends lines chunk by chunk. Readers come from join() and get the
+    lines from the start without waiting for the rest of the body; a line is
+    dropped once every attached reader has had it, so memory follows the
+    slowest reader rather than the playlist size. After that a new reader
+    can no longer replay the body, and join() returns None.
+    """
+
+    def __init__(self):
+        self.lines = []
+        # Index in the body of self.lines[0]
+        self.base = 0
+        # Attached reader -> index of the next line it will get
+        self.readers = {}
+        self.trim_scheduled = False
+        self.done = False
+        self.error = None
+        self.task = None
+        self._arrived = asyncio.Event()
+
+    async def open(self, url, headers=None):
+        host = urlparse(url).netloc
+        upstream_breaker.check(host)
+        try:
+            timeout = upstream_timeout()
+        except DeadlineExceeded:
+            upstream_breaker.abandon(host)
+            raise
+        start = time.perf_counter()
+        UPSTREAM_IN_FLIGHT.inc()
+        try:
+            response = await open_upstream(url, with_user_agent(headers), timeout, host)
+        except asyncio.CancelledError:
+            UPSTREAM_IN_FLIGHT.dec()
+            upstream_breaker.abandon(host)
+            raise
+        except Exception as e:
+            UPSTREAM_IN_FLIGHT.dec()
+            UPSTREAM_ERRORS.inc(host, type(e).__name__)
+            upstream_breaker.record_error(host, e)
+            raise
+        UPSTREAM_RESPONSES.inc(host, str(response.status))
+        upstream_breaker.record(host, response.status)
+        if response.status >= 400:
+            # An error body is not a playlist: never stream it to the player
+            await response.release()
+            UPSTREAM_IN_FLIGHT.dec()
+            require_ok(url, response.status)
+        self.task = asyncio.ensure_future(self._pump(response, host, start))
+
+    async def _pump(self, response, host, start):
+        pending = b""
+        try:
+            async for chunk in response.content.iter_any():
+                *complete, pending = (pending + chunk).split(b"\n")
+                if complete:
+                    self._publish([line.decode("utf-8", "replace") for line in complete])
+            self._publish([pending.decode("utf-8", "replace")])
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(host, type(e).__name__)
+            upstream_breaker.record_error(host, e)
+            self.error = e
+        finally:
+            await response.release()
+            UPSTREAM_IN_FLIGHT.dec()
+            STAGE_SECONDS.observe(time.perf_counter() - start, "manifest")
+            self.done = True
+            self._arrived.set()
+
+    def _publish(self, lines):
+        self.lines.extend(lines)
+        self._arrived.set()
+        self._arrived = asyncio.Event()
+
+    def join(self):
+        """A reader starting at the first line, or None once lines have been dropped."""
+        if self.base:
+            return None
+        reader = ManifestReader(self)
+        self.readers[reader] = 0
+        return reader
+
+    def batches(self):
+        """Lines of the whole body for a single reader; see ManifestReader.batches."""
+        return self.join().batches()
+
+    def _advance(self, reader, position):
+        self.readers[reader] = position
+        self._schedule_trim()
+
+    def _detach(self, reader):
+        self.readers.pop(reader, None)
+        self._schedule_trim()
+
+    def _schedule_trim(self):
+        # On the loop's next turn, so every caller woken together by one
+        # SingleFlight has joined before the first lines go
+        if not self.trim_scheduled:
+            self.trim_scheduled = True
+            asyncio.get_running_loop().call_soon(self._trim)
+
+    def _trim(self):
+        self.trim_scheduled = False
+        # With no reader left nobody needs the held lines, and none can join any more
+        low = min(self.readers.values(), default=self.base + len(self.lines))
+        if low > self.base:
+            del self.lines[:low - self.base]
+            self.base = low
+
+class ManifestReader:
+    """One reader's position in a ManifestStream."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    async def batches(self):
+        """Yield lists of lines as they become available."""
+        stream = self.stream
+        try:
+            while True:
+                arrived = stream._arrived
+                sent = stream.readers[self]
+                if sent < stream.base + len(stream.lines):
+                    batch = stream.lines[sent - stream.base:]
+                    stream._advance(self, sent + len(batch))
+                    yield batch
+                elif stream.done:
+                    if stream.error is not None:
+                        raise stream.error
+                    return
+                else:
+                    await arrived.wait()
+        finally:
+            stream._detach(self)
+
+# Manifests whose body is still streaming in, so late joiners share it too
+live_manifests = {}
 
 def resolve_url(url, base_url):
     """Convert relative URL to absolute."""
@@ -34,81 +744,625 @@ def resolve_url(url, base_url):
     else:
         return urljoin(base_url, url)
 
-def rewrite_manifest(manifest_content, base_url):
-    """Rewrite manifest URLs to use nginx proxy."""
-    lines = manifest_content.split('\n')
-    modified_lines = []
-    
+# URI="..." attribute of #EXT-X-KEY / #EXT-X-MEDIA tags
+URI_ATTR_RE = re.compile(r'URI=(["\']?)([^",\s]+)\1')
+
+class ManifestRewriter:
+    """Rewrites manifest URLs relative to one base URL to use nginx proxy.
+
+    The proxied origin and directory prefixes are worked out once, so plain
+    relative segment names need no urlparse/urljoin call per line.
+    """
+
+    def __init__(self, base_url, proxy_base=NGINX_PROXY_BASE):
+        self.base_url = base_url
+        self.proxy_base = proxy_base
+        parsed = urlparse(base_url)
+        self.origin_prefix = f"{proxy_base}{parsed.scheme}://{parsed.netloc}"
+        # urljoin's own directory for this base, dot segments already resolved
+        self.directory_prefix = proxy_base + urljoin(base_url, "x")[:-1]
+
+    def proxied(self, url):
+        """Absolute, proxied form of a manifest URL (same result as resolve_url)."""
+        if url.startswith('http'):
+            return self.proxy_base + url
+        if url[0] == '/':
+            return self.origin_prefix + url
+        if is_plain_relative(url):
+            return self.directory_prefix + url
+        return self.proxy_base + urljoin(self.base_url, url)
+
+    def rewrite_line(self, line):
+        line = line.strip()
+        if not line:
+            return line
+        if line[0] != '#':
+            # Rewrite segment/playlist URLs
+            return self.proxied(line)
+        if line.startswith('#EXT-X-KEY:') or line.startswith('#EXT-X-MEDIA'):
+            # Rewrite encryption key and media (audio/subtitles) URLs
+            uri_match = URI_ATTR_RE.search(line)
+            if uri_match:
+                return line.replace(uri_match.group(0), f'URI="{self.proxied(uri_match.group(2))}"')
+        # Keep comments and other tags as-is
+        return line
+
+    def rewrite_lines(self, lines):
+        return '\n'.join([self.rewrite_line(line) for line in lines])
+
+    def rewrite(self, manifest_content):
+        return self.rewrite_lines(manifest_content.split('\n'))
+
+def is_plain_relative(url):
+    """True when urljoin would simply append `url` to the base directory.
+
+    Anything urljoin normalises (dot segments, empty segments, schemes,
+    params, bare queries or fragments) takes the slow path instead.
+    """
+    path = url.split('?', 1)[0]
+    return (
+        path != ''
+        and path[0] != '.'
+        and '/.' not in path
+        and '//' not in path
+        and ':' not in path
+        and ';' not in path
+        and '#' not in url
+        and url[-1] != '?'
+    )
+
+class LocalPlaylistRewriter(ManifestRewriter):
+    """ManifestRewriter that sends some playlists to local URLs, not nginx."""
+
+    def __init__(self, base_url, local_urls):
+        super().__init__(base_url)
+        self.resolver = ManifestRewriter(base_url, proxy_base="")
+        self.local_urls = local_urls
+
+    def proxied(self, url):
+        absolute = self.resolver.proxied(url)
+        return self.local_urls.get(absolute) or self.proxy_base + absolute
+
+def master_playlist_uris(lines, base_url):
+    """Absolute URIs of every variant and rendition in a master playlist."""
+    resolver = ManifestRewriter(base_url, proxy_base="")
+    uris = []
+    expect_variant = False
     for line in lines:
         line = line.strip()
-        
-        if line.startswith('#EXT-X-KEY:'):
-            # Rewrite encryption key URLs
-            uri_match = re.search(r'URI=(["\']?)([^",\s]+)\1', line)
+        if line.startswith('#EXT-X-STREAM-INF'):
+            expect_variant = True
+        elif line.startswith('#EXT-X-MEDIA'):
+            uri_match = URI_ATTR_RE.search(line)
             if uri_match:
-                original_uri = uri_match.group(2)
-                full_uri = resolve_url(original_uri, base_url)
-                proxied_uri = f"{NGINX_PROXY_BASE}{full_uri}"
-                new_attr = f'URI="{proxied_uri}"'
-                line = line.replace(uri_match.group(0), new_attr)
-            modified_lines.append(line)
-            
+                uris.append(resolver.proxied(uri_match.group(2)))
+        elif line and not line.startswith('#') and expect_variant:
+            uris.append(resolver.proxied(line))
+            expect_variant = False
+    return uris
+
+TAG_ATTR_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+SUBTITLES_ATTR_RE = re.compile(r',SUBTITLES="([^"]*)"')
+
+def tag_attributes(line):
+    """Attributes of an HLS tag line, quotes stripped."""
+    return {name: value.strip('"') for name, value in TAG_ATTR_RE.findall(line.split(':', 1)[-1])}
+
+def matches_language(attributes, wanted):
+    """True when a rendition's LANGUAGE (or NAME) is one of `wanted`."""
+    language = attributes.get("LANGUAGE", "").lower()
+    name = attributes.get("NAME", "").lower()
+    return any(language == code or language.startswith(code + "-") or name == code for code in wanted)
+
+class RenditionFilter:
+    """Drops master playlist variants and renditions a client asked not to get.
+
+    Works line by line, so it can sit in front of the streaming rewrite. An
+    audio group that would lose every rendition keeps its default one, and
+    if no variant fits the caps the smallest is kept; both are appended at
+    the end, where finish() returns them.
+
+    A variant whose SUBTITLES group has no kept rendition yet is held back
+    until finish(), since HLS lets the renditions come after the variants;
+    later variants are held with it so their order is kept.
+    """
+
+    def __init__(self, max_height=None, max_bandwidth=None, audio=None, subs=None):
+        self.max_height = max_height
+        self.max_bandwidth = max_bandwidth
+        self.audio = audio
+        self.subs = subs
+        self.dropping = None
+        self.variants_kept = 0
+        self.smallest_dropped = None
+        self.audio_kept = set()
+        self.audio_fallbacks = {}
+        self.subtitles_kept = set()
+        self.holding = None
+        self.held = []
+
+    @classmethod
+    def from_query(cls, args):
+        """Filter for the max_height/max_bandwidth/audio/subs query options, or None.
+
+        Raises ValueError for a malformed option.
+        """
+        options = {}
+        for name in ("max_height", "max_bandwidth"):
+            value = args.get(name)
+            if value:
+                if not value.isdigit() or int(value) == 0:
+                    raise ValueError(f"{name} must be a positive integer")
+                options[name] = int(value)
+        for name in ("audio", "subs"):
+            value = args.get(name)
+            if value:
+                options[name] = {code.strip().lower() for code in value.split(",") if code.strip()}
+        return cls(**options) if options else None
+
+    def fits(self, attributes):
+        bandwidth = int(attributes.get("BANDWIDTH", "0") or 0)
+        if self.max_bandwidth is not None and bandwidth > self.max_bandwidth:
+            return False
+        height = attributes.get("RESOLUTION", "").partition("x")[2]
+        if self.max_height is not None and height.isdigit() and int(height) > self.max_height:
+            return False
+        return True
+
+    def keep_media(self, line):
+        attributes = tag_attributes(line)
+        kind = attributes.get("TYPE")
+        group = attributes.get("GROUP-ID")
+        if kind == "AUDIO" and self.audio is not None:
+            if matches_language(attributes, self.audio):
+                self.audio_kept.add(group)
+                return True
+            if group not in self.audio_fallbacks or attributes.get("DEFAULT") == "YES":
+                self.audio_fallbacks[group] = line
+            return False
+        if kind == "SUBTITLES" and self.subs is not None:
+            if "none" not in self.subs and matches_language(attributes, self.subs):
+                self.subtitles_kept.add(group)
+                return True
+            return False
+        return True
+
+    def subtitles_known(self, line):
+        """Whether a variant tag's SUBTITLES group is already known to be kept (or needs no check)."""
+        if self.subs is None:
+            return True
+        match = SUBTITLES_ATTR_RE.search(line)
+        return match is None or match.group(1) in self.subtitles_kept
+
+    def variant_tag(self, line):
+        """Variant tag without a SUBTITLES group that was filtered away."""
+        if self.subs is None:
+            return line
+        return SUBTITLES_ATTR_RE.sub(lambda m: m.group(0) if m.group(1) in self.subtitles_kept else "", line)
+
+    def filter_lines(self, lines):
+        kept = []
+        for line in lines:
+            stripped = line.strip()
+            if self.dropping is not None:
+                # Lines up to the dropped variant's URI go with it
+                self.dropping.append(stripped)
+                if stripped and stripped[0] != '#':
+                    bandwidth = int(tag_attributes(self.dropping[0]).get("BANDWIDTH", "0") or 0)
+                    if self.smallest_dropped is None or bandwidth < self.smallest_dropped[0]:
+                        self.smallest_dropped = (bandwidth, self.dropping)
+                    self.dropping = None
+                continue
+            if self.holding is not None:
+                self.holding.append(line)
+                if stripped and stripped[0] != '#':
+                    self.held.append(self.holding)
+                    self.holding = None
+                continue
+            if stripped.startswith('#EXT-X-STREAM-INF'):
+                if self.fits(tag_attributes(stripped)):
+                    self.variants_kept += 1
+                    if self.held or not self.subtitles_known(stripped):
+                        self.holding = [stripped]
+                    else:
+                        kept.append(stripped)
+                else:
+                    RENDITIONS_DROPPED.inc("variant")
+                    self.dropping = [stripped]
+                continue
+            if stripped.startswith('#EXT-X-I-FRAME-STREAM-INF') and not self.fits(tag_attributes(stripped)):
+                RENDITIONS_DROPPED.inc("iframe")
+                continue
+            if stripped.startswith('#EXT-X-MEDIA:') and not self.keep_media(stripped):
+                RENDITIONS_DROPPED.inc(tag_attributes(stripped).get("TYPE", "media").lower())
+                continue
+            kept.append(line)
+        return kept
+
+    def finish(self):
+        """Fallback lines to append once the whole master has been filtered."""
+        tail = [line for group, line in self.audio_fallbacks.items() if group not in self.audio_kept]
+        for variant in self.held + ([self.holding] if self.holding else []):
+            tail += [self.variant_tag(variant[0]), *variant[1:]]
+        if not self.variants_kept and self.smallest_dropped is not None:
+            variant = self.smallest_dropped[1]
+            tail += [self.variant_tag(variant[0]), *variant[1:]]
+        return tail
+
+# Token tables: one JSON list of absolute URLs per compact playlist, shared by
+# workers, plus this process's parsed copies so resolving is a list index
+token_tables = cache.open_cache("tokens", TOKEN_CACHE_SIZE)
+parsed_token_tables = cache.MemoryCache(TOKEN_CACHE_SIZE)
+
+# Token indexes are what base36() writes; int(x, 36) alone would take "-1" or " 1"
+TOKEN_INDEX_RE = re.compile(r"[0-9a-z]+")
+
+def base36(n):
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while True:
+        n, digit = divmod(n, 36)
+        text = digits[digit] + text
+        if not n:
+            return text
+
+class CompactRewriter(ManifestRewriter):
+    """Rewrites a playlist with short tokens in place of proxied URLs.
+
+    Segment and key URLs are collected into one table per playlist and
+    become `t/<table>/<index>`, relative to wherever the playlist itself is
+    served. Variant and rendition playlists in a master point at the local
+    playlist endpoint instead, so they come back compact as well.
+
+    The table id is a hash of the playlist URL and the table itself, so a
+    reload of a live playlist gets a new table and tokens a player already
+    holds keep resolving to the URLs they were issued for.
+    """
+
+    # Stands in for the table id until every URL of the playlist is known
+    PENDING = "t/\0/"
+
+    def __init__(self, base_url):
+        super().__init__(base_url, proxy_base="")
+        self.table = None
+        self.urls = []
+        self.expect_variant = False
+
+    def proxied(self, url):
+        self.urls.append(super().proxied(url))
+        return f"{self.PENDING}{base36(len(self.urls) - 1)}"
+
+    def rewrite_lines(self, lines):
+        """Rewrite a whole playlist, then name its token table."""
+        playlist = super().rewrite_lines(lines)
+        digest = hashlib.blake2b(self.base_url.encode(), digest_size=8)
+        digest.update('\n'.join(self.urls).encode())
+        self.table = base64.urlsafe_b64encode(digest.digest()).rstrip(b"=").decode()
+        return playlist.replace(self.PENDING, f"t/{self.table}/")
+
+    def playlist_url(self, url):
+        absolute = ManifestRewriter.proxied(self, url)
+        return f"playlist?url={quote(absolute, safe='')}&compact=1"
+
+    def rewrite_line(self, line):
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF'):
+            self.expect_variant = True
         elif line.startswith('#EXT-X-MEDIA'):
-            # Rewrite media URLs (audio/subtitles)
-            uri_match = re.search(r'URI=(["\']?)([^",\s]+)\1', line)
+            uri_match = URI_ATTR_RE.search(line)
             if uri_match:
-                original_uri = uri_match.group(2)
-                full_uri = resolve_url(original_uri, base_url)
-                proxied_uri = f"{NGINX_PROXY_BASE}{full_uri}"
-                new_attr = f'URI="{proxied_uri}"'
-                line = line.replace(uri_match.group(0), new_attr)
-            modified_lines.append(line)
-            
-        elif line and not line.startswith('#'):
-            # Rewrite segment/playlist URLs
-            full_url = resolve_url(line, base_url)
-            proxied_url = f"{NGINX_PROXY_BASE}{full_url}"
-            modified_lines.append(proxied_url)
-            
-        else:
-            # Keep comments and empty lines as-is
-            modified_lines.append(line)
+                return line.replace(uri_match.group(0), f'URI="{self.playlist_url(uri_match.group(2))}"')
+        elif line and line[0] != '#' and self.expect_variant:
+            self.expect_variant = False
+            return self.playlist_url(line)
+        return super().rewrite_line(line)
+
+    async def save(self):
+        """Store the token table so any worker can resolve it."""
+        if self.urls:
+            expires_at = time.time() + TOKEN_TTL
+            await token_tables.aset(self.table, json.dumps(self.urls), expires_at)
+            parsed_token_tables.set(self.table, self.urls, expires_at)
+
+async def compact_rewrite(lines, base_url):
+    """Compact form of a playlist, with its token table saved."""
+    with STAGE_SECONDS.time("rewrite"):
+        rewriter = CompactRewriter(base_url)
+        playlist = rewriter.rewrite_lines(lines)
+    await rewriter.save()
+    return playlist
+
+async def resolve_token(table, index):
+    """Absolute upstream URL behind a compact playlist token, or None."""
+    urls = parsed_token_tables.get(table)
+    if urls is None:
+        stored = await token_tables.aget(table)
+        if stored is None:
+            return None
+        urls = json.loads(stored)
+        parsed_token_tables.set(table, urls, time.time() + TOKEN_TTL)
+    if not TOKEN_INDEX_RE.fullmatch(index):
+        return None
+    try:
+        return urls[int(index, 36)]
+    except IndexError:
+        return None
+
+def token_redirect_headers(url):
+    """Send the player (or nginx, internally) to the proxied URL."""
+    headers = {'Location': f"{NGINX_PROXY_BASE}{url}"}
+    if TOKEN_ACCEL:
+        headers['X-Accel-Redirect'] = f"/proxy/?url={url}"
+    return headers
+
+def rewrite_manifest(manifest_content, base_url):
+    """Rewrite manifest URLs to use nginx proxy."""
+    return ManifestRewriter(base_url).rewrite(manifest_content)
+
+async def rewrite_manifest_stream(stream, base_url, renditions=None):
+    """Yield the rewritten manifest in chunks while upstream is still sending.
+
+    `renditions` is an optional RenditionFilter applied before rewriting.
+    """
+    rewriter = ManifestRewriter(base_url)
+    separator = ''
+    elapsed = 0.0
+    async for lines in stream.batches():
+        start = time.perf_counter()
+        if renditions is not None:
+            lines = renditions.filter_lines(lines)
+            if not lines:
+                continue
+        chunk = separator + rewriter.rewrite_lines(lines)
+        elapsed += time.perf_counter() - start
+        yield chunk
+        separator = '\n'
+    if renditions is not None:
+        tail = renditions.finish()
+        if tail:
+            yield separator + rewriter.rewrite_lines(tail)
+    STAGE_SECONDS.observe(elapsed, "rewrite")
+
+
+# Targeted scanners for the three fields the scrape needs. They work on the
+# raw page text; when a page does not have the expected shape they return
+# None and the caller falls back to BeautifulSoup.
+
+DATA_PAGE_ATTR_RE = re.compile(r'\sdata-page="([^"]*)"')
+INERTIA_VERSION_RE = re.compile(r'&quot;version&quot;:\s*&quot;([^&"]*)&quot;')
+SRC_ATTR_RE = re.compile(r'\ssrc="([^"]*)"')
+TOKEN_RE = re.compile(r"'token':\s*'(\w+)'")
+EXPIRES_RE = re.compile(r"'expires':\s*'(\d+)'")
+SERVER_URL_RE = re.compile(r"url:\s*'([^']+)'")
+
+scan_fallbacks = {"version": 0, "iframe_src": 0, "script": 0}
+
+def scan_attribute(page, tag_start, attribute_re):
+    """Raw, still HTML-escaped attribute of the start tag at `tag_start`."""
+    tag_end = page.find('<', tag_start + 1)
+    match = attribute_re.search(page, tag_start, tag_end if tag_end != -1 else len(page))
+    return match.group(1) if match else None
+
+def scan_data_page(page):
+    """Escaped `data-page` of div#app, straight from the page text."""
+    app = page.find('id="app"')
+    if app == -1:
+        return None
+    tag_start = page.rfind('<', 0, app)
+    if not page.startswith('<div', tag_start):
+        return None
+    return scan_attribute(page, tag_start, DATA_PAGE_ATTR_RE)
+
+def scan_iframe_src(page):
+    """`src` of the first iframe, straight from the page text."""
+    tag_start = page.find('<iframe')
+    if tag_start == -1:
+        return None
+    src = scan_attribute(page, tag_start, SRC_ATTR_RE)
+    return html.unescape(src) if src is not None else None
+
+def scan_body_script(page):
+    """Body of the first script after <body>, straight from the page text."""
+    body = page.find('<body')
+    if body == -1:
+        return None
+    start = page.find('<script', body)
+    if start == -1:
+        return None
+    content_start = page.find('>', start) + 1
+    end = page.find('</script', content_start)
+    if content_start == 0 or end == -1:
+        return None
+    return page[content_start:end]
+
+def scan_inertia_version(page):
+    """Top-level inertia `version`, read without decoding the whole data-page.
+
+    Inertia serialises `version` after `props`, so the last match is the
+    top-level key even when some prop has a `version` field of its own.
+    """
+    data_page = scan_data_page(page)
+    if data_page is None:
+        return None
+    versions = INERTIA_VERSION_RE.findall(data_page)
+    return html.unescape(versions[-1]) if versions else None
+
+def parse_soup(page, *strainer):
+    """BeautifulSoup parse of the matching part of `page`.
+
+    bs4 and lxml are imported on first use: only scanner fallbacks need them.
+    """
+    from bs4 import BeautifulSoup, SoupStrainer
+    return BeautifulSoup(page, "lxml", parse_only=SoupStrainer(*strainer))
+
+def find_inertia_version(page):
+    """Inertia `version` from the `data-page` attribute of div#app."""
+    version = scan_inertia_version(page)
+    if version is None:
+        scan_fallbacks["version"] += 1
+        soup = parse_soup(page, "div", {"id": "app"})
+        try:
+            version = json.loads(soup.find("div", {"id": "app"}).get("data-page"))["version"]
+        except (AttributeError, TypeError, KeyError, ValueError) as e:
+            raise ExtractionError("No inertia version in div#app data-page") from e
+    return version
+
+def find_iframe_src(page):
+    """`src` of the first iframe."""
+    src = scan_iframe_src(page)
+    if src is None:
+        scan_fallbacks["iframe_src"] += 1
+        soup = parse_soup(page, "iframe")
+        iframe = soup.find("iframe")
+        src = iframe.get("src") if iframe is not None else None
+        if not src:
+            raise ExtractionError("No iframe src in page")
+    return src
+
+def find_body_script(page):
+    """Text of the first script inside body."""
+    script = scan_body_script(page)
+    if script is None:
+        scan_fallbacks["script"] += 1
+        soup = parse_soup(page, "body")
+        script = soup.find("script")
+        if script is None:
+            raise ExtractionError("No script in page body")
+        script = script.text
+    return script
+
+async def get_inertia_version(site_url):
+    """Return the site's inertia version, from cache when still fresh."""
+    version = await version_cache.aget(site_url)
+    if version is not None:
+        return version
+    return await version_flight.do(site_url, lambda: fetch_inertia_version(site_url))
+
+async def fetch_inertia_version(site_url):
+    """Fetch the inertia version from request-a-title and cache it."""
+    with STAGE_SECONDS.time("version"):
+        response = await fetch_page(f"{site_url}/request-a-title", {
+            "Referer": f"{site_url}/",
+            "Origin": f"{site_url}",
+        })
+        
+        version = find_inertia_version(response)
+    await version_cache.aset(site_url, version, time.time() + VERSION_TTL)
+    return version
+
+async def prewarm():
+    """Open pooled connections to PREWARM_SITES and cache their inertia version."""
+    async def warm(site_url):
+        try:
+            await get_inertia_version(site_url)
+        except Exception as e:
+            logger.warning(f"Prewarm of {site_url} failed: {e}")
     
-    return '\n'.join(modified_lines)
+    get_session()
+    if PREWARM_SITES:
+        await asyncio.wait([asyncio.ensure_future(warm(site)) for site in PREWARM_SITES], timeout=PREWARM_TIMEOUT)
+
+def start_prewarm():
+    """Prewarm in the background loop without delaying startup."""
+    if PREWARM_SITES:
+        asyncio.run_coroutine_threadsafe(prewarm(), get_loop())
+
+async def inertia_request(url, site_url, version):
+    """Inertia GET that refreshes a stale version once and retries.
+
+    Inertia answers 409 Conflict when `x-inertia-version` is out of date.
+    Returns (version, body) so later calls reuse the refreshed version.
+    """
+    status, response = await fetch(url, {"x-inertia": "true", "x-inertia-version": version})
+    if status == 409:
+        await version_cache.adelete(site_url)
+        VERSION_CONFLICTS.inc()
+        version = await get_inertia_version(site_url)
+        status, response = await fetch(url, {"x-inertia": "true", "x-inertia-version": version})
+    require_ok(url, status)
+    return version, response
+
+# Recently failed extractions, so retries fail fast instead of re-scraping
+failure_cache = cache.open_cache("failure", NEGATIVE_CACHE_SIZE)
 
 async def extract_vixcloud_manifest(url):
-    """Extract manifest URL from VixCloud page."""
+    """Extract manifest URL from VixCloud page, cached until its token expires."""
+    # A malformed URL is the caller's mistake: no upstream call, nothing cached
+    url_kind(url)
+    manifest_url = await manifest_cache.aget(url)
+    if manifest_url is not None:
+        return manifest_url
+    failure = await failure_cache.aget(url)
+    if failure is not None:
+        raise ExtractionError(failure)
+    try:
+        manifest_url, expires = await scrape_vixcloud_manifest(url)
+    except ExtractionError as e:
+        # Server errors are the breaker's business; remember only what a retry won't fix
+        if e.status is None or e.status < 500:
+            await failure_cache.aset(url, str(e), time.time() + NEGATIVE_TTL)
+        raise
+    expires_at = expires - MANIFEST_EXPIRY_MARGIN
+    if expires_at > time.time():
+        await manifest_cache.aset(url, manifest_url, expires_at)
+    return manifest_url
+
+async def scrape_vixcloud_manifest(url):
+    """Scrape the manifest URL and its `expires` timestamp from VixCloud."""
+    with EXTRACTIONS_IN_FLIGHT.track():
+        try:
+            result = await scrape_vixcloud_page(url)
+        except Exception:
+            EXTRACTIONS.inc("error")
+            raise
+    EXTRACTIONS.inc("ok")
+    return result
+
+def script_param(pattern, script, name):
+    """One player parameter from the embed script."""
+    match = pattern.search(script)
+    if match is None:
+        raise ExtractionError(f"No {name} in player script")
+    return match.group(1)
+
+def url_kind(url):
+    """"iframe" or "embed" for the VixCloud page a URL points at."""
+    if urlparse(url).scheme not in ("http", "https"):
+        raise InvalidUrl(f"Not an http(s) URL: {url}")
+    if "iframe" in url:
+        return "iframe"
+    if "movie" in url or "tv" in url:
+        return "embed"
+    raise InvalidUrl(f"Not a VixCloud iframe, movie or tv URL: {url}")
+
+async def scrape_vixcloud_page(url):
+    """Walk the VixCloud pages and read the player script's parameters."""
     
     # Handle iframe URLs
-    if "iframe" in url:
+    if url_kind(url) == "iframe":
         site_url = url.split("/iframe")[0]
         
         # Get version
-        response = await make_request(f"{site_url}/request-a-title", {
-            "Referer": f"{site_url}/",
-            "Origin": f"{site_url}",
-        })
-        
-        soup = BeautifulSoup(response, "lxml", parse_only=SoupStrainer("div", {"id": "app"}))
-        data = json.loads(soup.find("div", {"id": "app"}).get("data-page"))
-        version = data["version"]
+        version = await get_inertia_version(site_url)
         
         # Get iframe content
-        response = await make_request(url, {"x-inertia": "true", "x-inertia-version": version})
-        soup = BeautifulSoup(response, "lxml", parse_only=SoupStrainer("iframe"))
-        iframe = soup.find("iframe").get("src")
-        response = await make_request(iframe, {"x-inertia": "true", "x-inertia-version": version})
+        with STAGE_SECONDS.time("iframe"):
+            version, response = await inertia_request(url, site_url, version)
+            iframe = find_iframe_src(response)
+        with STAGE_SECONDS.time("embed"):
+            version, response = await inertia_request(iframe, site_url, version)
     
-    elif "movie" in url or "tv" in url:
-        response = await make_request(url)
+    else:
+        with STAGE_SECONDS.time("embed"):
+            response = await fetch_page(url)
     
     # Extract manifest URL from script
-    soup = BeautifulSoup(response, "lxml", parse_only=SoupStrainer("body"))
-    script = soup.find("body").find("script").text
-    
-    token = re.search(r"'token':\s*'(\w+)'", script).group(1)
-    expires = re.search(r"'expires':\s*'(\d+)'", script).group(1)
-    server_url = re.search(r"url:\s*'([^']+)'", script).group(1)
+    with STAGE_SECONDS.time("script"):
+        script = find_body_script(response)
+        
+        token = script_param(TOKEN_RE, script, "token")
+        expires = script_param(EXPIRES_RE, script, "expires")
+        server_url = script_param(SERVER_URL_RE, script, "url")
     
     # Build manifest URL
     if "?b=1" in server_url:
@@ -120,34 +1374,574 @@ async def extract_vixcloud_manifest(url):
     if "window.canPlayFHD = true" in script:
         manifest_url += "&h=1"
     
-    return manifest_url
+    return manifest_url, int(expires)
+
+async def start_manifest(url):
+    """Resolve the manifest for a VixCloud URL and start downloading it."""
+    # Get manifest URL
+    manifest_url = await extract_vixcloud_manifest(url)
+    
+    # Start streaming the manifest content
+    stream = ManifestStream()
+    try:
+        await stream.open(manifest_url, {"referer": url})
+    except ExtractionError:
+        # Upstream refused the cached token URL: scrape a fresh one next time
+        await manifest_cache.adelete(url)
+        raise
+    live_manifests[url] = (manifest_url, stream)
+    stream.task.add_done_callback(
+        lambda _: live_manifests.pop(url) if live_manifests.get(url, (None, None))[1] is stream else None)
+    return manifest_url, stream
+
+async def open_manifest(url):
+    """Return (manifest_url, reader) for a VixCloud URL; the reader has batches().
+
+    Concurrent requests for the same URL share one extraction and download,
+    as long as the body can still be replayed from the start; otherwise the
+    request gets a download of its own.
+    """
+    live = live_manifests.get(url)
+    if live is not None:
+        reader = live[1].join()
+        if reader is not None:
+            manifest_flight.coalesced += 1
+            return live[0], reader
+    manifest_url, stream = await manifest_flight.do(url, lambda: start_manifest(url))
+    reader = stream.join()
+    if reader is None:
+        manifest_url, stream = await start_manifest(url)
+        reader = stream.join()
+    return manifest_url, reader
+
+async def fetch_manifest(url):
+    """Resolve, download and rewrite the manifest for a VixCloud URL."""
+    manifest_url, stream = await open_manifest(url)
+    
+    # Rewrite URLs for nginx proxy
+    return ''.join([chunk async for chunk in rewrite_manifest_stream(stream, manifest_url)])
+
+playlist_cache = cache.open_cache("playlist", PREFETCH_CACHE_SIZE)
+playlist_prefetches = {}
+
+# One entry per manifest and encoding: the ETag, a newline, then the body
+rendered_cache = cache.open_cache("rendered", RENDERED_CACHE_SIZE)
+rendering = set()
+
+# Query options that change a manifest's rewritten text
+RENDER_OPTIONS = ("url", "max_height", "max_bandwidth", "audio", "subs", "compact")
 
-@app.route('/api/v1/vixcloud/manifest', methods=['GET'])
-def get_manifest():
-    """Extract VixCloud manifest and rewrite URLs."""
-    url = request.args.get('url')
+def rendered_key(route, args):
+    """Cache key for a rewritten manifest: the route plus its options."""
+    return route + "?" + "&".join(f"{name}={args.get(name)}" for name in RENDER_OPTIONS if args.get(name))
+
+def is_cacheable(text):
+    """Masters and VOD playlists stay the same between reloads."""
+    return "#EXT-X-STREAM-INF" in text or "#EXT-X-ENDLIST" in text
+
+def compress(body, encoding):
+    if encoding == "gzip":
+        return gzip.compress(body, GZIP_LEVEL, mtime=0)
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return body
+
+async def render(key, text):
+    """Encode a rewritten manifest every supported way, caching it when it is stable.
+
+    With `key` None nothing is cached. Returns {encoding: (etag, body)}. Compression runs in the default
+    executor so the event loop keeps serving.
+    """
+    body = text.encode()
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    loop = asyncio.get_running_loop()
+    variants = {"identity": (f'"{digest}"', body)}
+    for encoding in ("gzip", "br") if brotli is not None else ("gzip",):
+        with STAGE_SECONDS.time("compress"):
+            data = await loop.run_in_executor(None, compress, body, encoding)
+        # Strong ETags must differ between content codings of one resource
+        variants[encoding] = (f'"{digest}-{encoding}"', data)
+    if key is not None and is_cacheable(text):
+        expires_at = time.time() + RENDERED_TTL
+        for encoding, (etag, data) in variants.items():
+            await rendered_cache.aset(f"{encoding}:{key}", etag.encode() + b"\n" + data, expires_at)
+    return variants
+
+async def get_rendered(key, encoding):
+    """(etag, body) of a cached rendered manifest, or None."""
+    value = await rendered_cache.aget(f"{encoding}:{key}")
+    if value is None:
+        return None
+    etag, _, body = value.partition(b"\n")
+    return etag.decode(), body
+
+def predicts_cacheable(chunk):
+    """True when a chunk already shows the manifest is a master or a VOD playlist."""
+    return "#EXT-X-STREAM-INF" in chunk or "#EXT-X-PLAYLIST-TYPE:VOD" in chunk
+
+async def tee_rendered(chunks, key):
+    """Pass streamed chunks through, then render the whole manifest in the background.
+
+    Only a manifest that will be cached is copied in full: a master or a
+    playlist tagged VOD. Anything else is copied up to RENDER_BUFFER_BYTES
+    and dropped past that, so a long live playlist is not held twice.
+    """
+    parts = []
+    size = 0
+    cacheable = False
+    async for chunk in chunks:
+        if parts is not None:
+            parts.append(chunk)
+            size += len(chunk)
+            cacheable = cacheable or predicts_cacheable(chunk)
+            if not cacheable and size > RENDER_BUFFER_BYTES:
+                parts = None
+        yield chunk
+    if parts is None:
+        return
+    text = ''.join(parts)
+    del parts
+    if is_cacheable(text):
+        task = asyncio.ensure_future(render(key, text))
+        rendering.add(task)
+        task.add_done_callback(rendering.discard)
+
+def pick_encoding(accept_encoding):
+    """Best content coding the client accepts: br, then gzip, then identity."""
+    accepted = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ("br", "gzip"):
+        if encoding == "br" and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+def etag_matches(if_none_match, etag):
+    """Weak comparison, as If-None-Match requires."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def rendered_response(etag, body, encoding, if_none_match):
+    """(status, body, headers) for one encoding of a rendered manifest."""
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if etag_matches(if_none_match, etag):
+        return 304, b"", headers
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return 200, body, headers
+
+async def respond_rendered(key, text, encoding, if_none_match):
+    """Render `text` now and answer with the client's encoding."""
+    etag, body = (await render(key, text))[encoding]
+    return rendered_response(etag, body, encoding, if_none_match)
+
+async def respond_cached(key, encoding, if_none_match):
+    """Answer from the rendered cache, or None on a miss."""
+    hit = await get_rendered(key, encoding)
+    if hit is None:
+        return None
+    return rendered_response(*hit, encoding, if_none_match)
+
+def playlist_key(url, compact):
+    return f"compact:{url}" if compact else url
+
+async def prefetch_playlist(url, referer, compact=False):
+    """Fetch and rewrite one variant playlist into the prefetch cache."""
+    if await playlist_cache.acontains(playlist_key(url, compact)):
+        return
+    status, body = await fetch(url, {"referer": referer})
+    if status == 200:
+        if compact:
+            playlist = await compact_rewrite(body.split('\n'), url)
+        else:
+            with STAGE_SECONDS.time("rewrite"):
+                playlist = ManifestRewriter(url).rewrite(body)
+        await playlist_cache.aset(playlist_key(url, compact), playlist, time.time() + PREFETCH_TTL)
+
+def start_prefetch(urls, referer, compact=False):
+    """Fetch the given playlists concurrently in the background."""
+    pending = [url for url in urls if playlist_key(url, compact) not in playlist_prefetches]
+    if not pending:
+        return
+    task = asyncio.ensure_future(asyncio.gather(
+        *(prefetch_playlist(url, referer, compact) for url in pending),
+        return_exceptions=True,
+    ))
+    keys = [playlist_key(url, compact) for url in pending]
+    for key in keys:
+        playlist_prefetches[key] = task
+    task.add_done_callback(lambda _: [playlist_prefetches.pop(key, None) for key in keys])
+
+async def read_manifest(url, renditions=None):
+    """(manifest_url, lines) of the whole upstream manifest, filtered."""
+    manifest_url, stream = await open_manifest(url)
+    lines = [line async for batch in stream.batches() for line in batch]
+    if renditions is not None:
+        lines = renditions.filter_lines(lines) + renditions.finish()
+    return manifest_url, lines
+
+async def fetch_compact_manifest(url, renditions=None):
+    """Manifest rewritten with compact tokens (see CompactRewriter)."""
+    manifest_url, lines = await read_manifest(url, renditions)
+    return await compact_rewrite(lines, manifest_url)
+
+async def fetch_prefetched_manifest(url, renditions=None, compact=False):
+    """Master playlist whose variants are prefetched and served locally.
+
+    The master is read in full, every variant/rendition URI is fetched in
+    the background, and the rewritten master points those URIs at the
+    local playlist endpoint instead of nginx. Renditions removed by the
+    optional RenditionFilter are not prefetched.
+    """
+    manifest_url, lines = await read_manifest(url, renditions)
+    uris = master_playlist_uris(lines, manifest_url)
+    start_prefetch(uris, url, compact)
+    if compact:
+        return await compact_rewrite(lines, manifest_url)
+    local_urls = {uri: f"playlist?url={quote(uri, safe='')}" for uri in uris}
+    with STAGE_SECONDS.time("rewrite"):
+        return LocalPlaylistRewriter(manifest_url, local_urls).rewrite_lines(lines)
+
+async def get_prefetched_playlist(url, compact=False):
+    """Rewritten playlist from the prefetch cache, or None if not prefetched.
+
+    Waits for the prefetch when it is still in flight.
+    """
+    task = playlist_prefetches.get(playlist_key(url, compact))
+    if task is not None:
+        await asyncio.shield(task)
+    return await playlist_cache.aget(playlist_key(url, compact))
+
+async def get_compact_playlist(url):
+    """Compact variant playlist, prefetched or fetched now."""
+    playlist = await get_prefetched_playlist(url, compact=True)
+    if playlist is None:
+        playlist = await compact_rewrite((await fetch_page(url)).split('\n'), url)
+    return playlist
+
+class HostRateLimiter:
+    """Spaces out work per host to at most `rate` starts per second."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.next_slot = {}
+
+    async def wait(self, host):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self.next_slot.get(host, 0))
+        self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+batch_rate_limiter = HostRateLimiter(BATCH_HOST_RATE)
+
+async def extract_batch(urls):
+    """Yield one NDJSON line per URL, in completion order.
+
+    At most BATCH_CONCURRENCY extractions run at once, and each upstream
+    host gets at most BATCH_HOST_RATE new extractions per second.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    
+    async def extract_one(url):
+        async with semaphore:
+            await batch_rate_limiter.wait(urlparse(url).netloc)
+            try:
+                return {"url": url, "manifest_url": await with_deadline(extract_vixcloud_manifest(url))}
+            except Exception as e:
+                return {"url": url, "error": str(e), "status": error_status(e)}
+    
+    tasks = [asyncio.ensure_future(extract_one(url)) for url in urls]
+    try:
+        for result in asyncio.as_completed(tasks):
+            yield json.dumps(await result) + "\n"
+    finally:
+        # The client went away: stop the extractions nobody will read
+        for task in tasks:
+            task.cancel()
+
+def batch_urls(data):
+    """Validated list of URLs from a batch request body, or None."""
+    urls = data.get("urls") if isinstance(data, dict) else None
+    if not isinstance(urls, list) or not urls or len(urls) > BATCH_MAX_URLS:
+        return None
+    if not all(isinstance(url, str) and url for url in urls):
+        return None
+    return urls
+
+def flag(value, default):
+    """Parse an on/off query parameter."""
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes", "on")
+
+def iter_async(agen):
+    """Drive an async generator on the background loop from sync code."""
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(agen.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(agen.aclose(), loop).result()
+
+CACHES = {"version": version_cache, "manifest": manifest_cache, "playlist": playlist_cache, "failure": failure_cache,
+          "tokens": token_tables, "rendered": rendered_cache}
+FLIGHTS = {"version": version_flight, "manifest": manifest_flight}
+
+def cache_hit_ratios():
+    ratios = {}
+    for name, store in CACHES.items():
+        lookups = store.hits + store.misses
+        ratios[(name,)] = store.hits / lookups if lookups else 0.0
+    return ratios
+
+metrics.Callback("extractor_cache_hits_total", "Cache lookups that hit", "counter", ["cache"],
+                 lambda: {(name,): store.hits for name, store in CACHES.items()})
+metrics.Callback("extractor_cache_misses_total", "Cache lookups that missed", "counter", ["cache"],
+                 lambda: {(name,): store.misses for name, store in CACHES.items()})
+metrics.Callback("extractor_cache_hit_ratio", "Share of cache lookups that hit", "gauge", ["cache"],
+                 cache_hit_ratios)
+metrics.Callback("extractor_cache_entries", "Entries held in each cache", "gauge", ["cache"],
+                 lambda: {(name,): store.size() for name, store in CACHES.items()})
+metrics.Callback("extractor_coalesced_total", "Calls that joined an in-flight call", "counter", ["call"],
+                 lambda: {(name,): flight.coalesced for name, flight in FLIGHTS.items()})
+metrics.Callback("extractor_breaker_open", "1 while the host's circuit breaker is open or half-open", "gauge", ["host"],
+                 lambda: {(host,): 1 for host in upstream_breaker.stats()})
+metrics.Callback("extractor_scan_fallbacks_total", "Page scans that fell back to BeautifulSoup", "counter", ["field"],
+                 lambda: {(field,): count for field, count in scan_fallbacks.items()})
+
+async def render_metrics():
+    """Render on the event loop, where every metric is updated."""
+    return metrics.REGISTRY.render()
+
+async def extractor_stats():
+    """Collected on the event loop, which owns the cache connections."""
+    return {
+        "version_cache": {**await version_cache.astats(), "conflicts": VERSION_CONFLICTS.values.get((), 0)},
+        "manifest_cache": await manifest_cache.astats(),
+        "version_flight": version_flight.stats(),
+        "manifest_flight": manifest_flight.stats(),
+        "playlist_cache": await playlist_cache.astats(),
+        "failure_cache": await failure_cache.astats(),
+        "token_tables": await token_tables.astats(),
+        "rendered_cache": await rendered_cache.astats(),
+        "open_breakers": upstream_breaker.stats(),
+        "http2": http2_upstream.stats(),
+        "scan_fallbacks": scan_fallbacks,
+    }
+
+# ASGI serving mode: `uvicorn main:asgi_app` or `python main.py --asgi`.
+# Every request runs on the server's own event loop, so the shared session
+# and any other async state live on one persistent loop.
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+]
+
+async def asgi_send(send, status, body, content_type, extra_headers=()):
+    """Send a complete, non-streamed ASGI response."""
+    if isinstance(body, str):
+        body = body.encode()
+    headers = [
+        (b"content-type", content_type.encode()),
+        (b"content-length", str(len(body)).encode()),
+        *CORS_HEADERS,
+        *extra_headers,
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def asgi_stream(send, status, chunks, content_type):
+    """Send a chunked ASGI response from an async iterator of str chunks."""
+    headers = [(b"content-type", content_type.encode()), *CORS_HEADERS]
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    async for chunk in chunks:
+        if chunk:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+async def asgi_json(send, status, data):
+    await asgi_send(send, status, json.dumps(data), "application/json")
+
+async def asgi_lifespan(receive, send):
+    """Prewarm before accepting requests; close the upstream pool on shutdown."""
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await prewarm()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await close_upstream()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+def asgi_query(scope):
+    """First value of each query parameter."""
+    return {key: values[0] for key, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+
+async def asgi_get_manifest(scope, receive, send):
+    """ASGI twin of get_manifest, same URL contract."""
+    query = asgi_query(scope)
+    url = query.get("url")
     if not url:
-        return jsonify({"error": "Missing URL parameter"}), 400
+        return await asgi_json(send, 400, {"error": "Missing URL parameter"})
+    try:
+        renditions = RenditionFilter.from_query(query)
+    except ValueError as e:
+        return await asgi_json(send, 400, {"error": str(e)})
     
+    compact = flag(query.get("compact"), COMPACT_PLAYLISTS)
+    key = rendered_key("manifest", query)
+    encoding = pick_encoding(asgi_header(scope, b"accept-encoding"))
+    if_none_match = asgi_header(scope, b"if-none-match")
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        
-        # Get manifest URL
-        manifest_url = loop.run_until_complete(extract_vixcloud_manifest(url))
-        
-        # Download manifest content
-        manifest_content = loop.run_until_complete(make_request(manifest_url, {"referer": url}))
-        
-        # Rewrite URLs for nginx proxy
-        rewritten_manifest = rewrite_manifest(manifest_content, manifest_url)
-        
-        loop.close()
-        
-        return rewritten_manifest, 200, {'Content-Type': 'application/vnd.apple.mpegurl'}
-        
+        if flag(query.get("prefetch"), PREFETCH_VARIANTS):
+            text = await with_deadline(fetch_prefetched_manifest(url, renditions, compact))
+            return await asgi_manifest(send, *await respond_rendered(None, text, encoding, if_none_match))
+        cached = await respond_cached(key, encoding, if_none_match)
+        if cached is not None:
+            return await asgi_manifest(send, *cached)
+        if compact:
+            text = await with_deadline(fetch_compact_manifest(url, renditions))
+            return await asgi_manifest(send, *await respond_rendered(key, text, encoding, if_none_match))
+        manifest_url, stream = await with_deadline(open_manifest(url))
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return await asgi_json(send, error_status(e), {"error": str(e)})
+    chunks = tee_rendered(rewrite_manifest_stream(stream, manifest_url, renditions), key)
+    await asgi_stream(send, 200, chunks, MANIFEST_CONTENT_TYPE)
+
+def asgi_header(scope, name):
+    """Value of a request header (lower-case bytes name), or None."""
+    for header, value in scope["headers"]:
+        if header == name:
+            return value.decode("latin-1")
+    return None
+
+async def asgi_manifest(send, status, body, headers):
+    """Send a rendered manifest response."""
+    extra = [(name.lower().encode(), value.encode()) for name, value in headers.items()]
+    await asgi_send(send, status, body, MANIFEST_CONTENT_TYPE, extra)
+
+async def asgi_body(receive):
+    """Read the whole request body."""
+    body = b""
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+    return body
+
+async def asgi_post_manifest_batch(scope, receive, send):
+    """ASGI twin of post_manifest_batch."""
+    try:
+        data = json.loads(await asgi_body(receive))
+    except ValueError:
+        data = None
+    urls = batch_urls(data)
+    if urls is None:
+        return await asgi_json(send, 400, {"error": f"Body must be {{\"urls\": [...]}} with 1 to {BATCH_MAX_URLS} URLs"})
+    await asgi_stream(send, 200, extract_batch(urls), "application/x-ndjson")
+
+async def asgi_get_playlist(scope, receive, send):
+    """ASGI twin of get_playlist."""
+    url = asgi_query(scope).get("url")
+    if not url:
+        return await asgi_json(send, 400, {"error": "Missing URL parameter"})
+    
+    query = asgi_query(scope)
+    key = rendered_key("playlist", query)
+    encoding = pick_encoding(asgi_header(scope, b"accept-encoding"))
+    if_none_match = asgi_header(scope, b"if-none-match")
+    cached = await respond_cached(key, encoding, if_none_match)
+    if cached is not None:
+        return await asgi_manifest(send, *cached)
+    if flag(query.get("compact"), False):
+        try:
+            playlist = await with_deadline(get_compact_playlist(url))
+        except Exception as e:
+            return await asgi_json(send, error_status(e), {"error": str(e)})
+    else:
+        playlist = await get_prefetched_playlist(url)
+        if playlist is None:
+            return await asgi_send(send, 302, b"", "text/plain", [
+                (b"location", f"{NGINX_PROXY_BASE}{url}".encode()),
+            ])
+    await asgi_manifest(send, *await respond_rendered(key, playlist, encoding, if_none_match))
+
+async def asgi_get_token(scope, receive, send):
+    """ASGI twin of get_token."""
+    table, _, index = scope["path"][len("/api/v1/vixcloud/t/"):].partition("/")
+    url = await resolve_token(table, index)
+    if url is None:
+        return await asgi_json(send, 404, {"error": "Unknown or expired token, reload the playlist"})
+    headers = [(name.lower().encode(), value.encode()) for name, value in token_redirect_headers(url).items()]
+    await asgi_send(send, 302, b"", "text/plain", headers)
+
+async def asgi_get_stats(scope, receive, send):
+    await asgi_json(send, 200, await extractor_stats())
+
+async def asgi_get_metrics(scope, receive, send):
+    await asgi_send(send, 200, await render_metrics(), metrics.CONTENT_TYPE)
+
+ASGI_ROUTES = {
+    ("GET", "/api/v1/vixcloud/manifest"): asgi_get_manifest,
+    ("POST", "/api/v1/vixcloud/manifest/batch"): asgi_post_manifest_batch,
+    ("GET", "/api/v1/vixcloud/playlist"): asgi_get_playlist,
+    ("GET", "/api/v1/vixcloud/stats"): asgi_get_stats,
+    ("GET", "/metrics"): asgi_get_metrics,
+}
+
+# Routes whose path continues with parameters
+ASGI_PREFIX_ROUTES = {
+    ("GET", "/api/v1/vixcloud/t/"): asgi_get_token,
+}
+
+async def asgi_app(scope, receive, send):
+    """ASGI application exposing the same API as the Flask app."""
+    if scope["type"] == "lifespan":
+        return await asgi_lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    
+    path, method = scope["path"], scope["method"]
+    if method == "OPTIONS" and any(route_path == path for _, route_path in ASGI_ROUTES):
+        return await asgi_send(send, 200, b"", "text/plain", [
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+            (b"access-control-allow-headers", b"*"),
+        ])
+    handler = ASGI_ROUTES.get((method, path))
+    if handler is None:
+        handler = next((route for (route_method, prefix), route in ASGI_PREFIX_ROUTES.items()
+                        if route_method == method and path.startswith(prefix)), None)
+    if handler is None:
+        return await asgi_json(send, 404, {"error": "Not found"})
+    await handler(scope, receive, send)
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    if "--asgi" in sys.argv:
+        import uvicorn
+        uvicorn.run(asgi_app, host='0.0.0.0', port=5000)
+    else:
+        # flask_app imports this module back as `main`; share it instead of loading a second copy
+        sys.modules.setdefault("main", sys.modules["__main__"])
+        from flask_app import app
+        app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
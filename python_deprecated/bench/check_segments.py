@@ -0,0 +1,209 @@
+"""Check Range handling of the segment proxy and requests that follow a cache fill.
+
+Against a local stand-in upstream, with the segment cache on:
+  * parse_range_header: single, open-ended, suffix and multiple ranges,
+    clamping to the segment, the 416 cases and headers that are ignored;
+  * a cached segment answers 200, single and multipart 206 and 416, and
+    If-Range or an unknown unit gets the whole segment;
+  * full and ranged requests for a cold segment follow one upstream
+    download and get the right bytes while the first client has stopped
+    reading;
+  * a cold segment sent without Content-Length, slower than
+    HLS_PROXY_CACHE_FILL_WAIT, is still answered 200/206 with the right bytes
+    and never with `Content-Length: None`;
+  * a request that follows a download right after its temp file was renamed
+    into the cache reads the cached segment.
+
+    python bench/check_segments.py
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlparse
+
+os.environ['HLS_PROXY_CACHE_DIR'] = tempfile.mkdtemp(prefix='check-segments-')
+os.environ['HLS_PROXY_PREFETCH_SEGMENTS'] = '0'
+os.environ['HLS_PROXY_CACHE_FILL_WAIT'] = '1'
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import main  # noqa: E402
+
+PATTERN = bytes(range(251))
+CHUNK = 64 * 1024
+MB = 1024 * 1024
+
+
+def segment_bytes(n: int, size: int) -> bytes:
+    return (PATTERN * (size // len(PATTERN) + 2))[n:n + size]
+
+
+class Origin(BaseHTTPRequestHandler):
+    """Segmenti `/seg-<n>.ts?size=..&delay=..[&chunked=1]`; `delay` secondi tra un blocco e l'altro."""
+
+    protocol_version = 'HTTP/1.1'
+    hits = Counter()
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        Origin.hits[parsed.path] += 1
+        size = int(query.get('size', [str(MB)])[0])
+        data = segment_bytes(int(parsed.path.rsplit('-', 1)[1].split('.')[0]), size)
+        chunked = 'chunked' in query
+        if 'Range' in self.headers:
+            first, _, last = self.headers['Range'].split('=', 1)[1].partition('-')
+            start, end = int(first), int(last) if last else size - 1
+            data = data[start:end + 1]
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+            chunked = False
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', 'video/mp2t')
+        self.send_header('Transfer-Encoding' if chunked else 'Content-Length', 'chunked' if chunked else str(len(data)))
+        self.end_headers()
+        delay = float(query.get('delay', ['0'])[0])
+        try:
+            for i in range(0, len(data), CHUNK):
+                part = data[i:i + CHUNK]
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(part), part) if chunked else part)
+                self.wfile.flush()
+                time.sleep(delay)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def check_parser():
+    cases = {
+        'bytes=0-9': [(0, 9)],
+        'bytes=90-': [(90, 99)],
+        'bytes=-10': [(90, 99)],
+        'bytes=-200': [(0, 99)],
+        'bytes=95-200': [(95, 99)],
+        'bytes=0-1, 5-6': [(0, 1), (5, 6)],
+        'bytes=0-1,200-300': [(0, 1)],
+        'bytes=100-': [],
+        'bytes=-0': [],
+        'bytes=5-1': None,
+        'bytes=a-b': None,
+        'bytes=': None,
+        'items=0-1': None,
+        'bytes=' + ','.join(['0-0'] * (main.MAX_RANGES + 1)): None,
+    }
+    for value, expected in cases.items():
+        got = main.parse_range_header(value, 100)
+        assert got == expected, f'{value!r}: {got} != {expected}'
+    print(f'parse_range_header: {len(cases)} cases')
+
+
+def multipart(response):
+    """(Content-Range, corpo) di ogni parte di una risposta multipart/byteranges."""
+    boundary = response.headers['Content-Type'].split('boundary=')[1].encode()
+    parts = []
+    for part in response.data.split(b'--' + boundary)[1:-1]:
+        head, _, body = part.lstrip(b'\r\n').partition(b'\r\n\r\n')
+        content_range = [line for line in head.split(b'\r\n') if line.startswith(b'Content-Range:')][0]
+        parts.append((content_range.split(b': ')[1].decode(), body[:-2]))
+    return parts
+
+
+def run():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Origin)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    client = main.app.test_client()
+
+    def get(url, buffered=True, **headers):
+        return client.get(f"/api/v1/proxy/segment?url={quote(url, safe='')}", headers=headers, buffered=buffered)
+
+    check_parser()
+
+    url, data = f'{base}/seg-1.ts', segment_bytes(1, MB)
+    assert get(url).data == data
+    r = get(url)
+    assert (r.status_code, r.headers['X-Cache'], r.headers['Content-Length'], r.data) == (200, 'HIT', str(MB), data)
+    for value, start, end in (('bytes=10-19', 10, 19), ('bytes=-100', MB - 100, MB - 1), (f'bytes={MB - 5}-', MB - 5, MB - 1)):
+        r = get(url, Range=value)
+        assert r.status_code == 206 and r.headers['Content-Range'] == f'bytes {start}-{end}/{MB}', (value, r.headers)
+        assert r.data == data[start:end + 1], value
+    r = get(url, Range='bytes=0-9,1000-1099')
+    assert r.status_code == 206 and int(r.headers['Content-Length']) == len(r.data)
+    assert multipart(r) == [(f'bytes 0-9/{MB}', data[:10]), (f'bytes 1000-1099/{MB}', data[1000:1100])]
+    r = get(url, Range=f'bytes={2 * MB}-')
+    assert r.status_code == 416 and r.headers['Content-Range'] == f'bytes */{MB}'
+    for headers in ({'Range': 'bytes=0-9', 'If-Range': '"etag"'}, {'Range': 'items=0-9'}):
+        r = get(url, **headers)
+        assert r.status_code == 200 and r.data == data, headers
+    print('cached: 200, 206 single/suffix/open-ended/multipart, 416, If-Range and unknown unit')
+
+    # Il primo client legge un blocco e si ferma; gli altri non devono aspettarlo
+    size = 4 * MB
+    url, data = f'{base}/seg-2.ts?size={size}&delay=0.01', segment_bytes(2, size)
+    stalled = get(url, buffered=False)
+    first = next(iter(stalled.response))
+    started = time.perf_counter()
+    results = {}
+    wanted = {'full': {}, 'range': {'Range': 'bytes=3000000-3000099'}, 'multi': {'Range': 'bytes=0-0,-1'}}
+    threads = [threading.Thread(target=lambda name, headers: results.__setitem__(name, get(url, **headers)), args=item)
+               for item in wanted.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    assert results['full'].status_code == 200 and results['full'].data == data
+    assert results['range'].status_code == 206 and results['range'].data == data[3000000:3000100]
+    assert multipart(results['multi']) == [(f'bytes 0-0/{size}', data[:1]), (f'bytes {size - 1}-{size - 1}/{size}', data[-1:])]
+    assert all(r.headers['X-Cache'] == 'MISS' for r in results.values())
+    assert first + b''.join(stalled.response) == data
+    stalled.close()
+    assert Origin.hits['/seg-2.ts'] == 1, Origin.hits
+    assert get(url).headers['X-Cache'] == 'HIT'
+    print(f'cold fill: 3 requests behind a stalled client in {elapsed * 1000:.0f} ms, one upstream download')
+
+    # Senza Content-Length e più lento di HLS_PROXY_CACHE_FILL_WAIT: si va a upstream
+    url, data = f'{base}/seg-3.ts?chunked=1&delay=0.1', segment_bytes(3, MB)
+    threads = [threading.Thread(target=lambda name, headers: results.__setitem__(name, get(url, **headers)), args=item)
+               for item in (('full', {}), ('range', {'Range': 'bytes=0-99'}))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    full, ranged = results['full'], results['range']
+    assert full.status_code == 200 and full.data == data and full.headers.get('Content-Length', str(MB)) == str(MB), full.headers
+    assert ranged.status_code == 206 and ranged.data == data[:100], (ranged.status_code, ranged.data[:200])
+    print(f"no length, slow: 200 and 206 from upstream, upstream requests {Origin.hits['/seg-3.ts']}")
+
+    # Chi segue il download tra la rinomina del temporaneo e release() legge la cache
+    cache = main.proxy.segment_cache
+    url, data = f'{base}/seg-4.ts', segment_bytes(4, MB)
+    _, fill = cache.claim(url)
+    release = cache.release
+    cache.release = lambda *args: None
+    try:
+        cache.store(url, fill, (data[i:i + CHUNK] for i in range(0, MB, CHUNK)), 'video/mp2t', MB)
+        following = cache.follow(fill)
+    finally:
+        cache.release = release
+        cache.release(url)
+    assert following is None
+    f, size, _ = cache.get(url)
+    with f:
+        assert size == MB and f.read() == data
+    print('follower after the rename: served from the cache')
+
+    server.shutdown()
+    print('ok')
+
+
+if __name__ == '__main__':
+    run()
@@ -1,15 +1,24 @@
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import requests
+from requests.adapters import HTTPAdapter
 import re
 import json
+import hashlib
+import tempfile
+import threading
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.common.by import By
+import os
 import time
 import logging
-from urllib.parse import urlparse, urljoin, quote, unquote
-from typing import Dict, List, Tuple, Optional
+import random
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, urljoin, quote, unquote, parse_qsl, urlencode
+from typing import Dict, Generator, Iterator, List, Tuple, Optional
 
 # =========================
 # Logging configuration
@@ -17,12 +26,524 @@ from typing import Dict, List, Tuple, Optional
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# =========================
+# Streaming configuration
+# =========================
+# Dimensione dei blocchi con cui i segmenti vengono inoltrati al client
+SEGMENT_CHUNK_SIZE = int(os.environ.get('HLS_PROXY_CHUNK_SIZE', str(64 * 1024)))
+
+# Cache su disco dei segmenti: cartella e dimensione massima (0 la disattiva).
+# La cartella predefinita è diversa per ogni script; i processi che ne
+# condividono una (più worker) rispettano insieme lo stesso limite.
+SEGMENT_CACHE_DIR = os.environ.get('HLS_PROXY_CACHE_DIR', os.path.join(
+    tempfile.gettempdir(), 'hls-proxy-segments-' + os.path.splitext(os.path.basename(__file__))[0]))
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('HLS_PROXY_CACHE_MAX_MB', '1024')) * 1024 * 1024
+# Ogni quanti secondi l'indice viene riallineato ai file scritti o rimossi da altri processi
+SEGMENT_CACHE_RESCAN = 30
+# Un temporaneo non modificato da tanti secondi è di un download interrotto
+SEGMENT_TMP_MAX_AGE = 600
+# Secondi senza nuovi byte dopo i quali chi segue un download in corso dello stesso segmento rinuncia
+SEGMENT_FILL_WAIT = float(os.environ.get('HLS_PROXY_CACHE_FILL_WAIT', '30'))
+# Oltre questo numero di intervalli in un solo header Range si risponde con il segmento intero
+MAX_RANGES = 16
+# Prefetch: segmenti scaricati in anticipo dopo quello richiesto (0 lo disattiva),
+# download paralleli in tutto il processo e playlist di cui ricordare l'ordine
+PREFETCH_SEGMENTS = int(os.environ.get('HLS_PROXY_PREFETCH_SEGMENTS', '3'))
+PREFETCH_WORKERS = int(os.environ.get('HLS_PROXY_PREFETCH_WORKERS', '4'))
+PREFETCH_PLAYLISTS = int(os.environ.get('HLS_PROXY_PREFETCH_PLAYLISTS', '256'))
+# Parametri di autenticazione che cambiano a ogni playlist ma non cambiano il segmento
+VOLATILE_PARAMS = set(os.environ.get(
+    'HLS_PROXY_CACHE_IGNORE_PARAMS', 'token,expires,exp,e,hash,h,sig,signature,auth,st,policy,key-pair-id'
+).split(','))
+
+# =========================
+# Upstream connection configuration
+# =========================
+# Host upstream di cui tenere un pool di connessioni e connessioni tenute aperte per host
+UPSTREAM_POOL_HOSTS = int(os.environ.get('HLS_PROXY_POOL_HOSTS', '32'))
+UPSTREAM_POOL_SIZE = int(os.environ.get('HLS_PROXY_POOL_SIZE', str(max(16, PREFETCH_WORKERS * 4))))
+# Retry: attesa base e massima tra un tentativo e l'altro e attesa totale concessa a una richiesta, in secondi
+RETRY_BACKOFF_BASE = float(os.environ.get('HLS_PROXY_RETRY_BACKOFF', '0.25'))
+RETRY_BACKOFF_MAX = float(os.environ.get('HLS_PROXY_RETRY_BACKOFF_MAX', '2'))
+RETRY_BUDGET = float(os.environ.get('HLS_PROXY_RETRY_BUDGET', '3'))
+
 # =========================
 # Flask app setup
 # =========================
 app = Flask(__name__)
 CORS(app)
 
+# =========================
+# Segment Cache Class
+# =========================
+class SegmentFill:
+    """Download di un segmento verso la cache, letto dai client mentre arriva.
+
+    Chi scarica pubblica il temporaneo e la dimensione attesa appena upstream
+    risponde, poi i byte scritti. Il temporaneo viene rinominato o rimosso
+    solo tenendo `cond`, quindi chi lo ha aperto continua a leggerlo.
+    """
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.path: Optional[str] = None
+        self.size: Optional[int] = None
+        self.content_type = 'video/mp2t'
+        self.written = 0
+        self.finished = False
+        self.complete = False
+        # Risposta d'errore di upstream (corpo, status), da restituire senza riprovare
+        self.error: Optional[Tuple[bytes, int]] = None
+
+
+class FillReader:
+    """Temporaneo di un download in corso: read() aspetta i byte non ancora scritti."""
+
+    def __init__(self, f, fill: SegmentFill):
+        self.f = f
+        self.fill = fill
+        self.position = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.f.close()
+
+    def seek(self, offset: int):
+        self.f.seek(offset)
+        self.position = offset
+
+    def read(self, size: int) -> bytes:
+        fill = self.fill
+        with fill.cond:
+            if not fill.cond.wait_for(lambda: fill.written > self.position or fill.finished, SEGMENT_FILL_WAIT):
+                raise IOError(f"Nessun byte dal download del segmento da {SEGMENT_FILL_WAIT}s")
+            if fill.written <= self.position and not fill.complete:
+                raise IOError("Download del segmento interrotto")
+        chunk = self.f.read(size)
+        self.position += len(chunk)
+        return chunk
+
+
+class SegmentCache:
+    """Cache LRU dei segmenti su disco, limitata in byte.
+
+    Ogni segmento è un file `<chiave>.seg` con accanto `<chiave>.json` (URL e
+    Content-Type). I file vengono scritti in un temporaneo e rinominati solo
+    a download completo, quindi un lettore non vede mai un segmento a metà.
+    La cartella può essere condivisa da più processi: ognuno rilegge i file
+    presenti ogni SEGMENT_CACHE_RESCAN secondi e ne elimina i meno recenti,
+    così il limite vale per la cartella e non per il singolo processo.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict = OrderedDict()  # chiave -> (dimensione, content_type)
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Segmenti scaricati dal prefetcher e non ancora chiesti da un client
+        self.prefetched = set()
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+        # Segmenti in download verso la cache
+        self.filling: Dict[str, SegmentFill] = {}
+        self.coalesced = 0
+        self.scanned_at = 0.0
+        if self.enabled:
+            os.makedirs(directory, exist_ok=True)
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        """Chiave del segmento: URL senza i parametri di autenticazione volatili."""
+        parsed = urlparse(url)
+        query = sorted((k, v) for k, v in parse_qsl(parsed.query, keep_blank_values=True) if k.lower() not in VOLATILE_PARAMS)
+        normalized = parsed._replace(query=urlencode(query), fragment='').geturl()
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def _path(self, key: str, suffix: str) -> str:
+        return os.path.join(self.directory, key + suffix)
+
+    def _load(self):
+        """Ricostruisce l'indice dai file già presenti, dal meno recente."""
+        with self.lock:
+            self._rescan()
+        logger.info(f"Cache segmenti: {len(self.entries)} file, {self.total_bytes // (1024 * 1024)} MB in {self.directory}")
+
+    def _rescan(self):
+        """Riallinea l'indice ai file su disco e rientra nel limite; va chiamato con il lock."""
+        found = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith('.tmp-'):
+                # Solo i temporanei abbandonati: gli altri sono download in corso, anche di altri processi
+                try:
+                    if now - os.stat(path).st_mtime > SEGMENT_TMP_MAX_AGE:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            if not name.endswith('.seg'):
+                continue
+            entry = self._read_entry(name[:-4])
+            if entry is not None:
+                found.append(entry)
+        self.entries.clear()
+        self.total_bytes = 0
+        for _, key, size, content_type in sorted(found):
+            self.entries[key] = (size, content_type)
+            self.total_bytes += size
+        self.prefetched &= self.entries.keys()
+        self.scanned_at = time.monotonic()
+        self._evict()
+
+    def _read_entry(self, key: str) -> Optional[Tuple[float, str, int, str]]:
+        """(mtime, chiave, dimensione, content_type) di un segmento su disco, o None."""
+        try:
+            stat = os.stat(self._path(key, '.seg'))
+            with open(self._path(key, '.json')) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            # Segmento rimosso nel frattempo, anche da un altro processo
+            return None
+        except (OSError, ValueError):
+            self._remove_files(key)
+            return None
+        return stat.st_mtime, key, stat.st_size, meta.get('content_type', 'video/mp2t')
+
+    def __contains__(self, url: str) -> bool:
+        with self.lock:
+            return self.cache_key(url) in self.entries
+
+    def get(self, url: str) -> Optional[Tuple[object, int, str]]:
+        """Segmento in cache come (file aperto, dimensione, content_type), o None."""
+        if not self.enabled:
+            return None
+        key = self.cache_key(url)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                # Può averlo scritto un altro processo che usa la stessa cartella
+                found = self._read_entry(key)
+                if found is None:
+                    self.misses += 1
+                    return None
+                entry = found[2:]
+                self.entries[key] = entry
+                self.total_bytes += entry[0]
+            self.entries.move_to_end(key)
+            try:
+                os.utime(self._path(key, '.seg'))
+                # Aperto sotto lock: un'eviction successiva non lo invalida
+                f = open(self._path(key, '.seg'), 'rb')
+            except OSError:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self.hits += 1
+            if key in self.prefetched:
+                self.prefetched.discard(key)
+                self.prefetch_hits += 1
+        return f, entry[0], entry[1]
+
+    def claim(self, url: str) -> Tuple[bool, Optional[SegmentFill]]:
+        """Prenota il download di `url` verso la cache.
+
+        Restituisce (True, download) a chi deve scaricarlo, che lo passa a
+        store() o lo libera con release(); gli altri ricevono (False,
+        download) da seguire con follow(), o (False, None) se il segmento è
+        già in cache.
+        """
+        key = self.cache_key(url)
+        with self.lock:
+            if key in self.entries:
+                return False, None
+            current = self.filling.get(key)
+            if current is not None:
+                self.coalesced += 1
+                return False, current
+            fill = SegmentFill()
+            self.filling[key] = fill
+            return True, fill
+
+    def release(self, url: str, error: Optional[Tuple[bytes, int]] = None):
+        """Chiude la prenotazione di `url` e sveglia chi stava seguendo il download."""
+        with self.lock:
+            fill = self.filling.pop(self.cache_key(url), None)
+        if fill is not None:
+            with fill.cond:
+                fill.error = error
+                fill.finished = True
+                fill.cond.notify_all()
+
+    def follow(self, fill: SegmentFill) -> Optional[Tuple[object, int, str]]:
+        """Segmento in download come (FillReader, dimensione, content_type), o None.
+
+        Se upstream non dichiara la dimensione aspetta la fine del download e
+        restituisce None. None vuol dire che il download è finito (si cerca
+        con get()) o che non è partito o non è finito in tempo, e allora si
+        va a upstream.
+        """
+        with fill.cond:
+            fill.cond.wait_for(lambda: fill.path is not None or fill.finished, SEGMENT_FILL_WAIT)
+            if fill.size is None:
+                # Senza dimensione non si possono dare né Content-Length né intervalli
+                fill.cond.wait_for(lambda: fill.finished, SEGMENT_FILL_WAIT)
+                return None
+            if fill.finished or fill.path is None:
+                return None
+            f = open(fill.path, 'rb')
+        return FillReader(f, fill), fill.size, fill.content_type
+
+    def store(self, url: str, fill: SegmentFill, chunks: Generator[bytes, None, None], content_type: str,
+              expected_size: Optional[int], prefetched: bool = False) -> bool:
+        """Salva il segmento mentre arriva, leggibile da chi segue `fill`; entra in cache solo se arriva intero."""
+        key = self.cache_key(url)
+        fd, tmp_path = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        with fill.cond:
+            fill.path, fill.size, fill.content_type = tmp_path, expected_size, content_type
+            fill.cond.notify_all()
+        size = 0
+        complete = False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    f.flush()
+                    size += len(chunk)
+                    with fill.cond:
+                        fill.written = size
+                        fill.cond.notify_all()
+            complete = expected_size is None or size == expected_size
+        finally:
+            chunks.close()
+            with fill.cond:
+                if complete and size <= self.max_bytes:
+                    self._commit(key, url, tmp_path, size, content_type, prefetched)
+                else:
+                    os.remove(tmp_path)
+                # Il temporaneo non c'è più: chi arriva ora deve cercare con get()
+                fill.complete = complete
+                fill.finished = True
+                fill.cond.notify_all()
+            self.release(url)
+        return complete
+
+    def _commit(self, key: str, url: str, tmp_path: str, size: int, content_type: str, prefetched: bool):
+        meta_fd, meta_tmp = tempfile.mkstemp(prefix='.tmp-', dir=self.directory)
+        with os.fdopen(meta_fd, 'w') as f:
+            json.dump({'url': url, 'content_type': content_type}, f)
+        with self.lock:
+            try:
+                os.replace(meta_tmp, self._path(key, '.json'))
+                os.replace(tmp_path, self._path(key, '.seg'))
+            except FileNotFoundError:
+                logger.warning(f"Temporaneo del segmento sparito prima del salvataggio: {url}")
+                for path in (meta_tmp, tmp_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old[0]
+            self.entries[key] = (size, content_type)
+            self.total_bytes += size
+            if prefetched:
+                self.prefetched.add(key)
+            else:
+                self.prefetched.discard(key)
+            if time.monotonic() - self.scanned_at > SEGMENT_CACHE_RESCAN:
+                self._rescan()
+            else:
+                self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self.entries:
+            key = next(iter(self.entries))
+            self._drop(key)
+            self.evictions += 1
+            if key in self.prefetched:
+                self.prefetched.discard(key)
+                self.prefetch_wasted += 1
+
+    def _drop(self, key: str):
+        size, _ = self.entries.pop(key)
+        self.total_bytes -= size
+        self._remove_files(key)
+
+    def _remove_files(self, key: str):
+        for suffix in ('.seg', '.json'):
+            try:
+                os.remove(self._path(key, suffix))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'prefetch_hits': self.prefetch_hits,
+                'prefetch_wasted': self.prefetch_wasted,
+                'prefetch_unused': len(self.prefetched),
+                'filling': len(self.filling),
+                'coalesced': self.coalesced,
+            }
+
+# =========================
+# Segment Prefetcher Class
+# =========================
+class SegmentPrefetcher:
+    """Scarica in anticipo i segmenti che seguono quello chiesto da un client.
+
+    Le playlist media riscritte dal proxy registrano l'ordine dei loro
+    segmenti; quando un client chiede il segmento N, i segmenti N+1..N+K non
+    ancora in cache vengono scaricati in background da un pool di thread
+    limitato, così il client li trova già su disco.
+    """
+
+    def __init__(self, fetch, cache: SegmentCache, lookahead: int, workers: int, max_playlists: int):
+        self.fetch = fetch
+        self.cache = cache
+        self.lookahead = lookahead
+        self.max_playlists = max_playlists
+        self.playlists: OrderedDict = OrderedDict()  # chiave playlist -> URL dei segmenti in ordine
+        self.positions: Dict[str, Tuple[str, int]] = {}  # chiave segmento -> (chiave playlist, indice)
+        self.in_flight = set()
+        # Oltre questo numero di download in coda le nuove richieste di prefetch vengono scartate
+        self.max_pending = workers * max(lookahead, 1)
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') if self.enabled else None
+        self.scheduled = 0
+        self.skipped = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.lookahead > 0 and self.cache.enabled
+
+    def register_playlist(self, playlist_url: str, segment_urls: List[str]):
+        """Ricorda l'ordine dei segmenti di una playlist media appena riscritta."""
+        if not self.enabled or not segment_urls:
+            return
+        playlist_key = SegmentCache.cache_key(playlist_url)
+        with self.lock:
+            self._forget(playlist_key)
+            self.playlists[playlist_key] = segment_urls
+            for index, url in enumerate(segment_urls):
+                self.positions[SegmentCache.cache_key(url)] = (playlist_key, index)
+            while len(self.playlists) > self.max_playlists:
+                self._forget(next(iter(self.playlists)))
+
+    def _forget(self, playlist_key: str):
+        segment_urls = self.playlists.pop(playlist_key, None)
+        for url in segment_urls or ():
+            key = SegmentCache.cache_key(url)
+            if self.positions.get(key, (None,))[0] == playlist_key:
+                del self.positions[key]
+
+    def segment_requested(self, url: str):
+        """Un client ha chiesto `url`: mette in coda i K segmenti successivi."""
+        if not self.enabled:
+            return
+        with self.lock:
+            position = self.positions.get(SegmentCache.cache_key(url))
+            if position is None:
+                return
+            playlist_key, index = position
+            self.playlists.move_to_end(playlist_key)
+            upcoming = self.playlists[playlist_key][index + 1:index + 1 + self.lookahead]
+        for next_url in upcoming:
+            key = SegmentCache.cache_key(next_url)
+            if next_url in self.cache:
+                continue
+            with self.lock:
+                if key in self.in_flight:
+                    continue
+                if len(self.in_flight) >= self.max_pending:
+                    self.skipped += 1
+                    continue
+                self.in_flight.add(key)
+                self.scheduled += 1
+            self.executor.submit(self._run, next_url, key)
+
+    def _run(self, url: str, key: str):
+        try:
+            if not self.fetch(url):
+                with self.lock:
+                    self.failed += 1
+        except Exception as e:
+            logger.warning(f"Prefetch fallito per {url}: {e}")
+            with self.lock:
+                self.failed += 1
+        finally:
+            with self.lock:
+                self.in_flight.discard(key)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'lookahead': self.lookahead,
+                'scheduled': self.scheduled,
+                'skipped': self.skipped,
+                'failed': self.failed,
+                'in_flight': len(self.in_flight),
+                'playlists': len(self.playlists),
+            }
+
+# =========================
+# Byte range helpers
+# =========================
+def parse_range_header(value: str, size: int) -> Optional[List[Tuple[int, int]]]:
+    """Intervalli (inizio, fine inclusa) di un header `Range: bytes=...` su `size` byte.
+
+    None se l'header va ignorato (sintassi non valida, unità diversa da
+    bytes, troppi intervalli): si risponde con il segmento intero. Lista
+    vuota se nessun intervallo cade nel file: si risponde 416.
+    """
+    unit, _, specs = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not specs.strip():
+        return None
+    specs = specs.split(',')
+    if len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        first, sep, last = spec.strip().partition('-')
+        if not sep or not (first.isdigit() or (not first and last.isdigit())) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffisso: gli ultimi N byte
+            length = int(last)
+            if length > 0 and size > 0:
+                ranges.append((max(size - length, 0), size - 1))
+            continue
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, min(int(last), size - 1) if last else size - 1))
+    return ranges
+
 # =========================
 # HLS Proxy Class
 # =========================
@@ -44,30 +565,63 @@ class HLSProxy:
         }
         self.timeout = 30
         self.max_retries = 3
+        # Un solo pool di connessioni per tutti i thread; ogni thread ha la sua Session
+        # perché i cookie di una Session non sono thread-safe
+        self.adapter = HTTPAdapter(pool_connections=UPSTREAM_POOL_HOSTS, pool_maxsize=UPSTREAM_POOL_SIZE)
+        self.local = threading.local()
+        self.segment_cache = SegmentCache(SEGMENT_CACHE_DIR, SEGMENT_CACHE_MAX_BYTES)
+        self.prefetcher = SegmentPrefetcher(
+            self._prefetch_segment, self.segment_cache, PREFETCH_SEGMENTS, PREFETCH_WORKERS, PREFETCH_PLAYLISTS)
+
+    def _session(self) -> requests.Session:
+        """Session del thread corrente, montata sul pool di connessioni condiviso."""
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+            self.local.session = session
+        return session
+
+    def _backoff(self, attempt: int) -> float:
+        """Attesa prima del tentativo successivo: esponenziale, limitata, con jitter pieno."""
+        return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** attempt))
 
     def _make_request(self, url: str, stream: bool = False, headers: Optional[Dict] = None) -> requests.Response:
-        """Effettua una richiesta HTTP con retry automatico."""
+        """Effettua una richiesta HTTP con retry automatico.
+
+        Le connessioni vengono riusate tra richieste e thread. Tra un tentativo
+        e l'altro si attende con backoff esponenziale e jitter, senza superare
+        RETRY_BUDGET secondi di attesa complessiva per richiesta.
+        """
         request_headers = {**self.headers}
         if headers:
             request_headers.update(headers)
         if 'vixsrc.to' in url:
             request_headers.update({'Referer': 'https://allupplay.xyz', 'Origin': 'https://allupplay.xyz'})
+        session = self._session()
+        budget = RETRY_BUDGET
         for attempt in range(self.max_retries):
+            delay = self._backoff(attempt)
+            last_attempt = attempt == self.max_retries - 1 or delay > budget
             try:
-                response = requests.get(url, headers=request_headers, timeout=self.timeout, stream=stream, allow_redirects=True)
+                # Come con requests.get, nessun cookie passa da una richiesta all'altra
+                session.cookies.clear()
+                response = session.get(url, headers=request_headers, timeout=self.timeout, stream=stream, allow_redirects=True)
                 if response.status_code == 200:
                     return response
-                elif response.status_code in [403, 404] and attempt < self.max_retries - 1:
+                elif response.status_code in [403, 404] and not last_attempt:
                     logger.warning(f"Tentativo {attempt + 1} fallito per {url}: {response.status_code}")
-                    time.sleep(1)
-                    continue
+                    # Libera la connessione invece di lasciarla appesa al corpo non letto
+                    response.close()
                 else:
                     return response
             except Exception as e:
                 logger.error(f"Errore richiesta tentativo {attempt + 1}: {e}")
-                if attempt == self.max_retries - 1:
+                if last_attempt:
                     raise
-                time.sleep(1)
+            budget -= delay
+            time.sleep(delay)
         raise Exception(f"Tutti i tentativi falliti per {url}")
 
     def proxy_playlist(self, url: str) -> Tuple[str, int, Dict]:
@@ -80,6 +634,10 @@ class HLSProxy:
             # Se è un file TS o altro binario
             content_type = response.headers.get('Content-Type', '').lower()
             if url.lower().endswith('.ts') or 'video' in content_type or 'octet-stream' in content_type:
+                if response.status_code != 200:
+                    content = response.text
+                    response.close()
+                    return content, response.status_code, {}
                 headers = {
                     'Content-Type': content_type or 'video/mp2t',
                     'Access-Control-Allow-Origin': '*',
@@ -88,11 +646,8 @@ class HLSProxy:
                     'Accept-Ranges': 'bytes',
                     'Cache-Control': 'public, max-age=3600'
                 }
-                if 'Content-Length' in response.headers:
-                    headers['Content-Length'] = response.headers['Content-Length']
-                if response.status_code == 206 and 'Content-Range' in response.headers:
-                    headers['Content-Range'] = response.headers['Content-Range']
-                return response.content, response.status_code, headers
+                headers.update(self._passthrough_headers(response))
+                return self._stream_body(response), response.status_code, headers
             # Altrimenti, prova come M3U8
             content = response.text
             if content.strip().startswith('WEBVTT'):
@@ -164,6 +719,7 @@ class HLSProxy:
         """Processa un media playlist M3U8."""
         lines = content.split('\n')
         modified_lines = []
+        segment_urls = []
         for line in lines:
             line = line.strip()
             if line.startswith('#EXT-X-KEY:'):
@@ -174,9 +730,11 @@ class HLSProxy:
                     proxied_url = f"/api/v1/proxy/subtitle?url={quote(segment_url, safe='')}"
                 else:
                     proxied_url = f"/api/v1/proxy/segment?url={quote(segment_url, safe='')}"
+                    segment_urls.append(segment_url)
                 modified_lines.append(proxied_url)
             else:
                 modified_lines.append(line)
+        self.prefetcher.register_playlist(base_url, segment_urls)
         return '\n'.join(modified_lines)
 
     def _process_media_tag(self, line: str, base_url: str) -> str:
@@ -219,30 +777,173 @@ class HLSProxy:
         else:
             return urljoin(base_url, url)
 
-    def proxy_segment(self, url: str, request_headers: Dict) -> Tuple[bytes, int, Dict]:
-        """Proxy per segmenti video con supporto Range."""
+    def proxy_segment(self, url: str, request_headers: Dict) -> Tuple[Iterator[bytes], int, Dict]:
+        """Proxy per segmenti video con supporto Range, inoltrati a blocchi.
+
+        I segmenti vengono serviti dalla cache su disco quando presenti, anche
+        a intervalli. Un segmento non in cache viene scaricato in background
+        alla velocità di upstream, e tutte le richieste contemporanee, compresa
+        quella che lo ha avviato, lo leggono dal file mentre cresce: un client
+        lento non rallenta né il download né gli altri client.
+        """
         try:
-            headers = {}
-            if 'Range' in request_headers:
-                headers['Range'] = request_headers['Range']
-            response = self._make_request(url, stream=True, headers=headers)
-            response_headers = {
-                'Content-Type': response.headers.get('Content-Type', 'video/mp2t'),
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, Authorization, Range',
-                'Accept-Ranges': 'bytes',
-                'Cache-Control': 'public, max-age=3600'
-            }
-            if 'Content-Length' in response.headers:
-                response_headers['Content-Length'] = response.headers['Content-Length']
-            if response.status_code == 206 and 'Content-Range' in response.headers:
-                response_headers['Content-Range'] = response.headers['Content-Range']
-            return response.content, response.status_code, response_headers
+            self.prefetcher.segment_requested(url)
+            # Senza validatori da confrontare, un If-Range si tratta come non corrispondente
+            range_header = request_headers.get('Range') if 'If-Range' not in request_headers else None
+            if not self.segment_cache.enabled:
+                return self._forward_segment(url, range_header)
+            cached = self.segment_cache.get(url)
+            if cached is not None:
+                return self._serve_cached(cached, range_header)
+            owner, fill = self.segment_cache.claim(url)
+            if owner:
+                self._fill_in_background(url, fill)
+            following = self.segment_cache.follow(fill) if fill is not None else None
+            if following is not None:
+                return self._serve_cached(following, range_header, 'MISS')
+            if fill is not None and fill.error is not None:
+                content, status = fill.error
+                return content, status, {}
+            cached = self.segment_cache.get(url)
+            if cached is None:
+                return self._forward_segment(url, range_header)
+            return self._serve_cached(cached, range_header)
         except Exception as e:
             logger.error(f"Errore proxy segment: {e}")
             return f"Errore: {str(e)}".encode(), 500, {}
 
+    def _forward_segment(self, url: str, range_header: Optional[str]) -> Tuple[Iterator[bytes], int, Dict]:
+        """Inoltra il segmento da upstream senza passare dalla cache."""
+        headers = {'Range': range_header} if range_header else {}
+        response = self._make_request(url, stream=True, headers=headers)
+        if response.status_code not in (200, 206):
+            # Corpo d'errore piccolo: lo leggiamo tutto per il messaggio JSON
+            content = response.content
+            response.close()
+            return content, response.status_code, {}
+        response_headers = self._segment_headers(response.headers.get('Content-Type', 'video/mp2t'))
+        response_headers.update(self._passthrough_headers(response))
+        return self._stream_body(response), response.status_code, response_headers
+
+    def _fill_in_background(self, url: str, fill: SegmentFill):
+        """Avvia in un thread il download verso la cache prenotato con claim()."""
+        def run():
+            try:
+                self._fill_segment(url, fill)
+            except Exception as e:
+                logger.warning(f"Download del segmento in cache fallito: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _fill_segment(self, url: str, fill: SegmentFill, prefetched: bool = False) -> bool:
+        """Scarica un segmento intero nella cache; `fill` è la prenotazione ottenuta con claim()."""
+        try:
+            response = self._make_request(url, stream=True)
+        except Exception:
+            self.segment_cache.release(url)
+            raise
+        if response.status_code not in (200, 206):
+            # Corpo d'errore piccolo: chi segue il download lo riceve così com'è
+            content = response.content
+            response.close()
+            self.segment_cache.release(url, (content, response.status_code))
+            return False
+        expected_size = int(response.headers['Content-Length']) if 'Content-Length' in response.headers else None
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or (expected_size or 0) > self.segment_cache.max_bytes):
+            # Chi segue il download andrà a upstream da solo
+            response.close()
+            self.segment_cache.release(url)
+            return False
+        content_type = response.headers.get('Content-Type', 'video/mp2t')
+        return self.segment_cache.store(url, fill, self._stream_body(response), content_type, expected_size, prefetched)
+
+    def _prefetch_segment(self, url: str) -> bool:
+        """Scarica un segmento nella cache senza client in attesa, se nessuno lo sta già scaricando."""
+        owner, fill = self.segment_cache.claim(url)
+        return self._fill_segment(url, fill, prefetched=True) if owner else True
+
+    def _serve_cached(self, cached: Tuple[object, int, str], range_header: Optional[str],
+                      source: str = 'HIT') -> Tuple[Iterator[bytes], int, Dict]:
+        """Risponde dal file in cache, o da un download in corso (`source` MISS): intero (200), uno o più intervalli (206) o 416."""
+        f, size, content_type = cached
+        ranges = parse_range_header(range_header, size) if range_header else None
+        if ranges == []:
+            f.close()
+            return b'Range non soddisfacibile', 416, {'Content-Range': f'bytes */{size}'}
+        response_headers = self._segment_headers(content_type)
+        response_headers['X-Cache'] = source
+        if ranges is None:
+            response_headers['Content-Length'] = str(size)
+            return self._stream_file(f), 200, response_headers
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response_headers.update({'Content-Range': f'bytes {start}-{end}/{size}', 'Content-Length': str(end - start + 1)})
+            return self._stream_file(f, start, end - start + 1), 206, response_headers
+        boundary = uuid.uuid4().hex
+        parts = [(f'\r\n--{boundary}\r\nContent-Type: {content_type}\r\nContent-Range: bytes {start}-{end}/{size}\r\n\r\n'.encode(), start, end)
+                 for start, end in ranges]
+        closing = f'\r\n--{boundary}--\r\n'.encode()
+        length = sum(len(head) + end - start + 1 for head, start, end in parts) + len(closing)
+        response_headers.update({'Content-Type': f'multipart/byteranges; boundary={boundary}', 'Content-Length': str(length)})
+        return self._stream_multipart(f, parts, closing), 206, response_headers
+
+    def _segment_headers(self, content_type: str) -> Dict:
+        """Headers standard per segmenti video."""
+        return {
+            'Content-Type': content_type,
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+            'Access-Control-Allow-Headers': 'Content-Type, Authorization, Range',
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': 'public, max-age=3600'
+        }
+
+    def _stream_file(self, f, offset: int = 0, length: Optional[int] = None) -> Iterator[bytes]:
+        """Legge un segmento dalla cache (o `length` byte da `offset`) a blocchi di SEGMENT_CHUNK_SIZE."""
+        with f:
+            yield from self._read_span(f, offset, length)
+
+    def _stream_multipart(self, f, parts: List[Tuple[bytes, int, int]], closing: bytes) -> Iterator[bytes]:
+        """Corpo multipart/byteranges: per ogni intervallo la sua intestazione e i suoi byte."""
+        with f:
+            for head, start, end in parts:
+                yield head
+                yield from self._read_span(f, start, end - start + 1)
+            yield closing
+
+    def _read_span(self, f, offset: int, length: Optional[int]) -> Iterator[bytes]:
+        f.seek(offset)
+        while length is None or length > 0:
+            chunk = f.read(SEGMENT_CHUNK_SIZE if length is None else min(SEGMENT_CHUNK_SIZE, length))
+            if not chunk:
+                return
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+
+    def _passthrough_headers(self, response: requests.Response) -> Dict:
+        """Headers di upstream da inoltrare così come sono insieme al corpo grezzo."""
+        headers = {}
+        for name in ('Content-Length', 'Content-Encoding'):
+            if name in response.headers:
+                headers[name] = response.headers[name]
+        if response.status_code == 206 and 'Content-Range' in response.headers:
+            headers['Content-Range'] = response.headers['Content-Range']
+        return headers
+
+    def _stream_body(self, response: requests.Response) -> Iterator[bytes]:
+        """Inoltra il corpo grezzo a blocchi di SEGMENT_CHUNK_SIZE, senza tenerlo tutto in memoria.
+
+        Il corpo non viene decompresso, così Content-Length e Content-Encoding di upstream restano validi.
+        """
+        try:
+            for chunk in response.raw.stream(SEGMENT_CHUNK_SIZE, decode_content=False):
+                if chunk:
+                    yield chunk
+        finally:
+            response.close()
+
     def proxy_key(self, url: str) -> Tuple[bytes, int, Dict]:
         """Proxy per chiavi di crittografia."""
         try:
@@ -476,8 +1177,8 @@ def proxy_segment():
     try:
         url = unquote(url)
         content, status_code, headers = proxy.proxy_segment(url, request.headers)
-        if status_code != 200:
-            return jsonify({'error': content.decode()}), status_code
+        if status_code not in (200, 206):
+            return jsonify({'error': content.decode(errors='replace')}), status_code, headers
         return Response(content, status=status_code, headers=headers)
     except Exception as e:
         logger.error(f"Errore proxy segment: {e}")
@@ -531,6 +1232,11 @@ def proxy_subtitle():
         logger.error(f"Errore proxy subtitle: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/v1/proxy/stats')
+def proxy_stats():
+    """Statistiche della cache segmenti e del prefetch."""
+    return jsonify({'segment_cache': proxy.segment_cache.stats(), 'prefetch': proxy.prefetcher.stats()})
+
 @app.route('/api/v1/vixsrc/key')
 def vixsrc_key():
     """Endpoint diretto per chiave vixsrc."""
@@ -579,6 +1285,11 @@ def api_docs():
             "path": "/api/v1/proxy/subtitle?url=<url>",
             "desc": "Proxy per sottotitoli."
         },
+        "proxy_stats": {
+            "method": "GET",
+            "path": "/api/v1/proxy/stats",
+            "desc": "Statistiche della cache segmenti e del prefetch."
+        },
         "vixsrc_key": {
             "method": "GET",
             "path": "/api/v1/vixsrc/key",